@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures  # noqa: E402
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption(
+        "--bench-posts",
+        type=int,
+        default=10000,
+        help="Number of posts in the generated benchmark database",
+    )
+    parser.addoption(
+        "--bench-db",
+        help="Benchmark against this existing posts database instead",
+    )
+
+
+@pytest.fixture(scope="session")
+def posts_db(request: pytest.FixtureRequest, tmp_path_factory: pytest.TempPathFactory) -> str:
+    """A posts.sqlite3 style database, generated once per session"""
+    db_name = request.config.getoption("--bench-db")
+    if db_name:
+        return db_name
+    db_name = str(tmp_path_factory.mktemp("db") / "posts.sqlite3")
+    fixtures.populate_db(db_name, request.config.getoption("--bench-posts"))
+    return db_name
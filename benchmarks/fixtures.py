@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Synthetic www.lse.co.uk share chat pages and posts.sqlite3 databases, for
+benchmarking dumplse.py and sentiment_analysis.py without touching LSE
+
+eg.
+    $ ./benchmarks/fixtures.py page --layout user --posts 25 > page.html
+    $ ./benchmarks/fixtures.py db big.sqlite3 --posts 10000000
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+from random import Random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dumplse  # noqa: E402
+from sentiment_analysis import NEGATIVE, POSITIVE  # noqa: E402
+
+USERS = [f"user{n:03d}" for n in range(500)]
+TICKERS = ["AFC", "RDSB", "BP.", "LLOY", "VOD", "TSCO", "GSK", "AZN", "HSBA", "BARC",
+           "RR.", "IAG", "BT.A", "GLEN", "RIO", "SHEL", "ULVR", "AAL", "NG.", "SSE"]
+OPINIONS = ["No Opinion", "Strong Buy", "Buy", "Weak Buy", "Hold",
+            "Weak Sell", "Sell", "Strong Sell"]
+FILLER = ("the a and of to in is it for on with as at this that results shares "
+          "price market news board today week year chart volume director update "
+          "contract revenue cash guidance placing dividend holders").split()
+KEYWORDS = sorted(POSITIVE | NEGATIVE)
+
+# Navigation, adverts and scripts, which a real chat page is mostly made of
+PAGE_NOISE = "".join(
+    f'<div class="advert advert--{n}"><script>window.ad{n}={{slot:{n}}};</script>'
+    f'<img src="/img/{n}.png" alt="ad"><ul class="nav">'
+    + "".join(f'<li class="nav__item"><a href="/x/{n}/{m}">Link {m}</a></li>' for m in range(8))
+    + "</ul></div>"
+    for n in range(60)
+)
+
+
+def post_text(rng: Random, words: int = 40) -> str:
+    """Some chat, with the odd sentiment keyword mixed in"""
+    text = [rng.choice(KEYWORDS) if rng.random() < 0.05 else rng.choice(FILLER) for _ in range(words)]
+    return " ".join(text)
+
+
+def chat_post_html(rng: Random, layout: str, ticker: str, when: datetime) -> tuple[str, dict]:
+    """
+    Returns the HTML of one share-chat-message__message-content block, and the
+    fields get_posts_from_page should find in it (with newlines kept)
+    """
+    username = rng.choice(USERS)
+    opinion = rng.choice(OPINIONS)
+    price = f"{rng.uniform(1, 2500):,.2f}"
+    title = f"RE: {rng.choice(FILLER).title()} {rng.choice(FILLER)}"
+    lines = [post_text(rng, rng.randrange(5, 30)) for _ in range(rng.randrange(1, 4))]
+    date = when.strftime("%d %b %Y %H:%M")
+
+    details = ['<p class="share-chat-message__details">' + ticker + " share chat</p>"]
+    if layout == "user":
+        details.append(f'<p class="share-chat-message__details">Posted in: {ticker}</p>')
+    details.append('<p class="share-chat-message__details">Posts: 1,234</p>')
+    details.append(f'<p class="share-chat-message__details">Price: {price}</p>')
+    details.append(f'<p class="share-chat-message__details">{opinion}</p>')
+
+    html = (
+        '<div class="share-chat-message__message-content">'
+        f'<div class="share-chat-message__avatar"><img src="/avatar/{username}.png"></div>'
+        f'<p class="share-chat-message__details--username">{username}</p>'
+        + "".join(details)
+        + f'<div class="share-chat-message__status-bar">{title}'
+        f'<span class="share-chat-message__status-bar-time">{date}</span></div>'
+        f'<p class="share-chat-message__message-text">{"<br>".join(lines)}</p>'
+        '<div class="share-chat-message__actions"><a href="#">Reply</a><a href="#">Report</a></div>'
+        "</div>"
+    )
+    expected = {
+        "username": username,
+        "ticker": ticker,
+        "atprice": price,
+        "opinion": opinion,
+        "date": str(datetime.strptime(date, "%d %b %Y %H:%M")),
+        "title": title,
+        "text": "\n".join(lines),
+    }
+    return html, expected
+
+
+def chat_page(
+    layout: str = "ticker",
+    posts: int = 25,
+    page: int = 1,
+    last_page: int = 10,
+    seed: int = 0,
+) -> tuple[str, list[dict]]:
+    """
+    Returns the HTML of a whole chat page in either the "ticker" or the "user"
+    (profile) layout, along with the fields of every post on it
+    """
+    rng = Random(f"{seed}-{layout}-{page}")
+    ticker = TICKERS[seed % len(TICKERS)]
+    when = datetime(2024, 3, 29, 15, 32) - timedelta(minutes=37 * posts * (page - 1))
+    blocks, expected = [], []
+    for _ in range(posts):
+        if layout == "user":
+            ticker = rng.choice(TICKERS)
+        html, fields = chat_post_html(rng, layout, ticker, when)
+        blocks.append(html)
+        expected.append(fields)
+        when -= timedelta(minutes=rng.randrange(1, 75))
+
+    pager = "".join(
+        f'<a class="pager__link" href="?page={n}">{n}</a>' for n in range(max(1, page - 2), min(last_page, page + 2) + 1)
+    )
+    if page + 3 < last_page:
+        # Like LSE's, the pager skips ahead to the last page
+        pager += f'<span class="pager__gap">...</span><a class="pager__link" href="?page={last_page}">{last_page}</a>'
+    if page < last_page:
+        pager += f'<a class="pager__link pager__link--next" href="?page={page + 1}">Next</a>'
+    html = (
+        "<!DOCTYPE html><html><head><title>Share Chat</title>"
+        + "".join(f'<link rel="stylesheet" href="/css/{n}.css">' for n in range(12))
+        + "</head><body>"
+        + PAGE_NOISE
+        + '<div class="share-chat">'
+        + "".join(blocks)
+        + f'</div><div class="pager">{pager}</div>'
+        + PAGE_NOISE
+        + "</body></html>"
+    )
+    return html, expected
+
+
+def populate_db(
+    db_name: str,
+    posts: int,
+    tickers: int = 20,
+    days: int = 365,
+    seed: int = 0,
+) -> None:
+    """
+    Fill a posts.sqlite3 style database with posts spread over tickers and
+    days from 2024-01-01, each ticker's price taking a random walk
+    """
+    CHUNK = 50000
+    rng = Random(seed)
+    names = TICKERS[:tickers] + [f"T{n:03d}" for n in range(max(0, tickers - len(TICKERS)))]
+    prices = {ticker: rng.uniform(20, 2000) for ticker in names}
+    start = datetime(2024, 1, 1)
+    step = days * 86400 / max(posts, 1)
+
+    conn = dumplse.create_db(db_name)
+    rows = []
+    for n in range(posts):
+        ticker = rng.choice(names)
+        prices[ticker] = max(1.0, prices[ticker] * rng.uniform(0.97, 1.03))
+        when = start + timedelta(seconds=int(n * step))
+        post = dumplse.ChatPost(
+            rng.choice(USERS),
+            ticker,
+            f"{prices[ticker]:,.2f}",
+            rng.choice(OPINIONS),
+            str(when.replace(second=0)),
+            f"RE: {rng.choice(FILLER)}",
+            post_text(rng),
+        )
+        rows.append(dumplse.post_row(post.hash(), post))
+        if len(rows) >= CHUNK:
+            dumplse.add_rows_to_db(conn, rows)
+            rows = []
+    dumplse.add_rows_to_db(conn, rows)
+    conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Make synthetic LSE share chat fixtures")
+    commands = parser.add_subparsers(dest="command", required=True)
+    page = commands.add_parser("page", help="Print a chat page of HTML")
+    page.add_argument("--layout", choices=["ticker", "user"], default="ticker")
+    page.add_argument("--posts", type=int, default=25)
+    page.add_argument("--page", type=int, default=1)
+    page.add_argument("--seed", type=int, default=0)
+    db = commands.add_parser("db", help="Create a populated posts database")
+    db.add_argument("db_name")
+    db.add_argument("--posts", type=int, default=10000)
+    db.add_argument("--tickers", type=int, default=20)
+    db.add_argument("--days", type=int, default=365)
+    db.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "page":
+        print(chat_page(args.layout, args.posts, args.page, seed=args.seed)[0])
+    else:
+        populate_db(args.db_name, args.posts, args.tickers, args.days, args.seed)
+
+
+if __name__ == "__main__":
+    main()
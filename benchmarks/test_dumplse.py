@@ -0,0 +1,435 @@
+import argparse
+import contextlib
+import copy
+import csv
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import astuple
+from datetime import datetime
+
+import pytest
+import requests
+from bs4 import BeautifulSoup
+
+import dumplse
+import fixtures
+
+PAGES = 20
+
+
+def make_arg(layout: str = "ticker", newlines: bool = True, **kwargs: object) -> argparse.Namespace:
+    arg = argparse.Namespace(
+        user="user001" if layout == "user" else None,
+        ticker=fixtures.TICKERS[0] if layout == "ticker" else None,
+        newlines=newlines,
+        debug=False,
+        save=False,
+        posts_max=131072,
+    )
+    vars(arg).update(kwargs)
+    return arg
+
+
+def report_rate(benchmark, name: str, count: int) -> None:
+    """Record count / mean time as name, unless run with --benchmark-disable"""
+    if benchmark.stats is not None:
+        benchmark.extra_info[name] = count / benchmark.stats.stats.mean
+
+
+def parsed_posts(layout: str = "ticker", pages: int = PAGES) -> list[dumplse.ChatPost]:
+    arg = make_arg(layout)
+    posts = []
+    for page in range(1, pages + 1):
+        html, _ = fixtures.chat_page(layout, page=page, last_page=pages)
+        posts += dumplse.get_posts_from_page(dumplse.parse_page(html), arg)
+    return posts
+
+
+@pytest.mark.parametrize("layout", ["ticker", "user"])
+@pytest.mark.parametrize("newlines", [True, False])
+def test_parse_fixture_page(layout: str, newlines: bool) -> None:
+    html, expected = fixtures.chat_page(layout, page=3)
+    soup = dumplse.parse_page(html)
+    posts = dumplse.get_posts_from_page(soup, make_arg(layout, newlines))
+
+    for fields in expected:
+        if not newlines:
+            fields["text"] = fields["text"].replace("\n", " ")
+    assert [astuple(post)[:7] for post in posts] == [tuple(fields.values()) for fields in expected]
+    assert soup.find("a", class_="pager__link pager__link--next") is not None
+
+
+def reference_posts(page: str, arg: argparse.Namespace) -> list[dumplse.ChatPost]:
+    """The parser as it was before PAGE_STRAINER, over the whole page with find/find_all"""
+    soup = BeautifulSoup(page, "html.parser")
+    posts = []
+    for post in soup.find_all(class_="share-chat-message__message-content"):
+        name = post.find(name="p", attrs="share-chat-message__details--username").getText()
+        details = post.find_all("p", attrs="share-chat-message__details")
+        if arg.ticker:
+            ticker, price, opinion = arg.ticker, details[2], details[3]
+        else:
+            ticker, price, opinion = details[1].text.replace("Posted in: ", ""), details[3], details[4]
+        title = post.find("div", attrs="share-chat-message__status-bar")
+        date = post.find("span", attrs="share-chat-message__status-bar-time").getText()
+        text = post.find("p", attrs="share-chat-message__message-text")
+        for br_tag in text.find_all("br"):
+            br_tag.replace_with(("\n" if arg.newlines else " ") + br_tag.text)
+        posts.append(
+            dumplse.ChatPost(
+                name,
+                ticker,
+                price.text.replace("Price: ", "").lstrip(),
+                opinion.getText(),
+                str(datetime.strptime(date, "%d %b %Y %H:%M")),
+                title.text.replace(date, ""),
+                text.getText(),
+            )
+        )
+    return posts
+
+
+ALERTS = [
+    "",
+    '<div class="alert alert--error"><ul><li>Login failed</li></ul></div>',
+    '<div class="alert alert--error"><ul><li>Too many requests</li></ul></div>',
+    '<div class="alert"><ul><li class="alert__list-item">Please refresh the page</li></ul></div>',
+]
+
+
+@pytest.mark.parametrize("alert", ALERTS)
+@pytest.mark.parametrize("layout", ["ticker", "user"])
+@pytest.mark.parametrize("newlines", [True, False])
+def test_parse_matches_reference(layout: str, newlines: bool, alert: str) -> None:
+    html, _ = fixtures.chat_page(layout, page=2)
+    html = html.replace('<div class="share-chat">', alert + '<div class="share-chat">')
+    arg = make_arg(layout, newlines)
+    soup = dumplse.parse_page(html)
+    assert dumplse.get_posts_from_page(soup, arg) == reference_posts(html, arg)
+    assert dumplse.detect_alerts(soup, arg) == dumplse.detect_alerts(BeautifulSoup(html, "html.parser"), arg)
+    assert dumplse.detect_alerts(soup, arg) == ("Too many" in alert)
+
+
+@pytest.mark.parametrize("depth", [0, 1])
+@pytest.mark.parametrize("fmt", ["ndjson", "csv"])
+def test_machine_formats(fmt: str, depth: int) -> None:
+    html, expected = fixtures.chat_page("ticker", page=2)
+    posts = dumplse.get_posts_from_page(dumplse.parse_page(html), make_arg())
+    out = io.StringIO()
+    writer = dumplse.PostWriter(fmt, out, depth)
+    writer.write(posts[:10])
+    writer.write(posts[10:])
+    writer.close()
+
+    if fmt == "ndjson":
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    else:
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert [row.pop("hash") for row in rows] == [post.hash() for post in posts]
+    assert rows == expected
+    assert "\033" not in out.getvalue()
+
+
+@pytest.mark.parametrize("page, expected", [(1, (10, True)), (7, (9, False)), (8, (10, False)), (10, (10, True))])
+def test_pager_last_page(page: int, expected: tuple[int, bool]) -> None:
+    html, _ = fixtures.chat_page(page=page, last_page=10)
+    assert dumplse.pager_last_page(dumplse.parse_page(html), page) == expected
+
+
+class FixtureBackend:
+    """Serves fixture pages for a chat of last_page pages, noting which were asked for"""
+
+    using_chrome = False
+
+    def __init__(self, posts: int = 25, last_page: int = 10) -> None:
+        self.posts = posts
+        self.last_page = last_page
+        self.fetched: list[int] = []
+
+    def escalate(self) -> bool:
+        return False
+
+    def get(self, url: str) -> str:
+        page = int(url.rsplit("=", 1)[1])
+        self.fetched.append(page)
+        if page > self.last_page:
+            return "<html><body></body></html>"
+        return fixtures.chat_page(posts=self.posts, page=page, last_page=self.last_page)[0]
+
+
+class NoPacer:
+    def wait(self, arg: argparse.Namespace) -> None:
+        pass
+
+    def done(self, latency: float) -> None:
+        pass
+
+    def struggling(self) -> None:
+        pass
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+@pytest.mark.parametrize(
+    "posts, page, posts_max, fetched",
+    [
+        (25, 1, 131072, range(1, 11)),
+        (50, 1, 131072, range(1, 11)),
+        (25, 4, 131072, range(4, 11)),
+        (25, 1, 60, range(1, 4)),
+        (50, 1, 60, range(1, 3)),
+        (50, 5, 500, range(5, 11)),
+    ],
+)
+def test_crawl_plan(jobs: int, posts: int, page: int, posts_max: int, fetched: range) -> None:
+    backend = FixtureBackend(posts)
+    arg = make_arg(posts_max=posts_max, jobs=jobs, archive=None, incremental=False)
+    out = io.StringIO()
+    dumplse.dump_pages("url?page=", arg, None, backend, NoPacer(), page, 4096, dumplse.PostWriter("ndjson", out))
+    assert backend.fetched == list(fetched)
+    assert len(out.getvalue().splitlines()) == min(posts_max, posts * (11 - page))
+
+
+@pytest.mark.parametrize("layout", ["ticker", "user"])
+def test_bench_parse(benchmark, layout: str) -> None:
+    pages = [fixtures.chat_page(layout, page=page, last_page=PAGES)[0] for page in range(1, PAGES + 1)]
+    arg = make_arg(layout)
+
+    def parse_all() -> int:
+        return sum(
+            len(dumplse.get_posts_from_page(dumplse.parse_page(html), arg)) for html in pages
+        )
+
+    posts = benchmark(parse_all)
+    report_rate(benchmark, "posts_per_sec", posts)
+
+
+def test_bench_chatpost_str(benchmark) -> None:
+    posts = parsed_posts()
+
+    def format_all() -> int:
+        # __str__ rewrites the opinion, so start from fresh copies each round
+        return sum(len(str(post)) for post in map(copy.copy, posts))
+
+    benchmark(format_all)
+    report_rate(benchmark, "posts_per_sec", len(posts))
+
+
+def test_bench_print_post_save(benchmark, tmp_path) -> None:
+    posts = parsed_posts()
+    arg = make_arg(save=True)
+    pages = [posts[n : n + 25] for n in range(0, len(posts), 25)]
+    rounds = iter(range(1_000_000))
+
+    def setup() -> tuple[tuple, dict]:
+        conn = dumplse.create_db(str(tmp_path / f"posts-{next(rounds)}.sqlite3"))
+        return (conn,), {}
+
+    def save_all(conn) -> int:
+        printed = 0
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for page in pages:
+                printed = dumplse.print_post(arg, [copy.copy(p) for p in page], printed, conn)
+        conn.close()
+        return printed
+
+    benchmark.pedantic(save_all, setup=setup, rounds=5)
+    report_rate(benchmark, "inserts_per_sec", len(posts))
+
+
+def http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (http_error(429), True),
+        (http_error(503), True),
+        (http_error(404), False),
+        (requests.ConnectionError(), True),
+        (requests.ReadTimeout(), True),
+        (AttributeError("'NoneType' object has no attribute 'get'"), False),
+    ],
+)
+def test_transient(error: Exception, expected: bool) -> None:
+    assert dumplse.transient(error) == expected
+
+
+def test_permanent_errors_spend_no_retries(monkeypatch) -> None:
+    class Missing(FixtureBackend):
+        def get(self, url: str) -> str:
+            self.fetched.append(url)
+            raise http_error(404)
+
+    backend = Missing()
+    pacer = dumplse.Pacer(5)
+    monkeypatch.setattr(pacer, "wait", lambda arg: None)
+    with pytest.raises(dumplse.FetchError):
+        dumplse.fetch_page(backend, pacer, "url?page=", 1, make_arg(archive=None))
+    assert len(backend.fetched) == 1 and pacer.retries == 0
+
+
+class ShuffledBackend(FixtureBackend):
+    """Finishes fetches in reverse order of page number"""
+
+    def get(self, url: str) -> str:
+        page = int(url.rsplit("=", 1)[1])
+        time.sleep(0.01 * (self.last_page - page))
+        return super().get(url)
+
+
+def test_archive_replays_in_page_order(tmp_path) -> None:
+    arg = make_arg(jobs=4, archive=str(tmp_path), incremental=False)
+    for _ in range(2):
+        dumplse.dump_pages("url?page=", arg, None, ShuffledBackend(), NoPacer(), 1, 4096, dumplse.PostWriter("ndjson", io.StringIO()))
+        time.sleep(1)
+
+    archived = list(dumplse.archived_pages(arg))
+    assert [page_num for _, page_num, _ in archived] == 2 * list(range(1, 11))
+    crawls = [os.path.dirname(path) for _, _, path in archived]
+    assert crawls == sorted(crawls) and len(set(crawls)) == 2
+
+
+def test_unwritable_metrics_file_carries_on(tmp_path, capsys) -> None:
+    dumplse.write_metrics(make_arg(metrics_file=str(tmp_path)))
+    assert "Error writing" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize(
+    "posts_max, pages_max, fetched",
+    [
+        (600, 4096, range(1, 13)),  # --posts_max caps the whole catch up, not each turn
+        (131072, 4096, range(1, 61)),
+        (131072, 15, range(1, 15)),  # Catching up stops at PAGES_MAX
+    ],
+)
+def test_watch_catches_up(tmp_path, monkeypatch, posts_max: int, pages_max: int, fetched: range) -> None:
+    sleeps = []
+    real_sleep = time.sleep
+
+    def sleep(seconds: float) -> None:
+        if threading.current_thread() is not threading.main_thread():
+            # The spinner's
+            return real_sleep(seconds)
+        # Stop at the first wait for a poll, once the catching up is done
+        sleeps.append(seconds)
+        if seconds > 1 or len(sleeps) > 100:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(dumplse.time, "sleep", sleep)
+    backend = FixtureBackend(posts=50, last_page=60)
+    arg = make_arg(
+        posts_max=posts_max,
+        jobs=2,
+        archive=None,
+        save=True,
+        targets=[(None, fixtures.TICKERS[0])],
+        metrics_file=None,
+    )
+    out = io.StringIO()
+    conn = dumplse.create_db(str(tmp_path / "posts.sqlite3"))
+    dumplse.watch_targets(arg, conn, backend, NoPacer(), dumplse.PostWriter("ndjson", out), pages_max)
+    assert backend.fetched == list(fetched)
+    assert len(out.getvalue().splitlines()) == min(posts_max, 50 * len(fetched))
+    assert len(sleeps) <= len(fetched) // 10 + 3
+
+
+def test_pacer_rate_ignores_jobs(monkeypatch) -> None:
+    delays: list[float] = []
+    monkeypatch.setattr(dumplse.time, "monotonic", lambda: 0.0)
+    monkeypatch.setattr(dumplse.time, "sleep", delays.append)
+    pacer = dumplse.Pacer(5)
+    # Eight jobs asking at once still start a page every two seconds, give or take jitter
+    for _ in range(8):
+        pacer.wait(make_arg())
+    assert len(delays) == 7
+    assert all(2 * n * 0.5 <= delay <= 2 * n * 1.5 for n, delay in enumerate(delays, 1))
+
+
+def test_incremental_fills_in_after_truncated_crawl(tmp_path) -> None:
+    conn = dumplse.create_db(str(tmp_path / "posts.sqlite3"))
+
+    def crawl(posts_max: int) -> list[int]:
+        backend = FixtureBackend()
+        arg = make_arg(posts_max=posts_max, jobs=1, archive=None, save=True, incremental=True)
+        dumplse.dump_pages("url?page=", arg, conn, backend, NoPacer(), 1, 4096, dumplse.PostWriter("ndjson", io.StringIO()))
+        return backend.fetched
+
+    def saved() -> int:
+        return conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    # Cut short, so there's no checkpoint for the next run to stop at
+    assert crawl(30) == [1, 2] and saved() == 30
+    assert crawl(131072) == list(range(1, 11)) and saved() == 250
+    # Now it's caught up
+    assert crawl(131072) == [1] and saved() == 250
+
+
+def test_seen_filter() -> None:
+    posts = 20000
+    seen = dumplse.SeenFilter(posts)
+    saved = [hashlib.sha256(f"saved {n}".encode()).hexdigest() for n in range(posts)]
+    for post_hash in saved:
+        seen.add(post_hash)
+    assert all(post_hash in seen for post_hash in saved)
+
+    new = [hashlib.sha256(f"new {n}".encode()).hexdigest() for n in range(posts)]
+    # ~1% at capacity, as BITS_PER_POST and PROBES are set for, give or take
+    assert sum(post_hash in seen for post_hash in new) / posts < 0.015
+
+
+def test_parse_jobs_match_serial() -> None:
+    outputs = []
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("forkserver")) as pool:
+        for parsers in (None, pool):
+            out = io.StringIO()
+            arg = make_arg(jobs=2, archive=None, incremental=False)
+            dumplse.dump_pages("url?page=", arg, None, FixtureBackend(), NoPacer(), 1, 4096, dumplse.PostWriter("ndjson", out), parsers)
+            outputs.append(out.getvalue())
+    assert len(outputs[0].splitlines()) == 250
+    assert outputs[1] == outputs[0]
+
+
+def test_batch_carries_on_past_failed_targets(tmp_path, monkeypatch, capsys) -> None:
+    class BatchBackend(FixtureBackend):
+        def __init__(self) -> None:
+            super().__init__()
+            self.urls: list[str] = []
+
+        def get(self, url: str) -> str:
+            self.urls.append(url)
+            if "/profiles/" in url:
+                raise http_error(404)
+            return super().get(url)
+
+        def close(self) -> None:
+            pass
+
+    backend = BatchBackend()
+    monkeypatch.setattr(dumplse, "FetchBackend", lambda arg: backend)
+    monkeypatch.setattr(dumplse, "Pacer", lambda pause_max: NoPacer())
+    batch = tmp_path / "batch.txt"
+    batch.write_text("ticker AFC\n# a comment\nuser nobody\nticker vod\n")
+    monkeypatch.setattr("sys.argv", ["dumplse.py", "-b", str(batch), "-f", "ndjson"])
+
+    with pytest.raises(SystemExit) as raised:
+        dumplse.main()
+    assert raised.value.code == 1
+    out, err = capsys.readouterr()
+    assert "gave up on user:nobody" in err
+    base = "https://www.lse.co.uk/ShareChat.asp?ShareTicker="
+    assert backend.urls == (
+        [f"{base}AFC&page={page}" for page in range(1, 11)]
+        + ["https://www.lse.co.uk/profiles/nobody/?page=1"]
+        + [f"{base}VOD&page={page}" for page in range(1, 11)]
+    )
+    assert {json.loads(line)["ticker"] for line in out.splitlines()} == {"AFC", "VOD"}
+    assert len(out.splitlines()) == 2 * 10 * 25
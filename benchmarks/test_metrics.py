@@ -0,0 +1,27 @@
+import json
+
+from metrics import Metrics
+
+
+def test_metrics_outputs(tmp_path) -> None:
+    metrics = Metrics()
+    metrics.count("pages", 2)
+    for seconds in (0.002, 0.3, 0.3, 90):
+        metrics.observe("fetch", seconds)
+    with metrics.time("parse"):
+        pass
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"] == {"pages": 2}
+    assert snapshot["stages"]["fetch"]["count"] == 4
+    assert snapshot["stages"]["fetch"]["p50"] == 0.5
+    assert snapshot["stages"]["fetch"]["max"] == 90
+
+    text = metrics.prometheus()
+    assert 'dumplse_stage_seconds_bucket{stage="fetch",le="0.5"} 3' in text
+    assert 'dumplse_stage_seconds_bucket{stage="fetch",le="+Inf"} 4' in text
+    assert "dumplse_pages_total 2" in text
+
+    metrics.write_json(str(tmp_path / "metrics.json"))
+    assert json.loads((tmp_path / "metrics.json").read_text())["counters"] == {"pages": 2}
+    assert "fetch" in metrics.summary()
@@ -0,0 +1,67 @@
+import sqlite3
+from collections import Counter
+from datetime import datetime
+
+import pytest
+
+import dumplse
+import fixtures
+import normalise
+
+
+def reference(rows: list[tuple], minutes: int, by: str) -> dict[str, dict[int, int]]:
+    """Bins as the old line by line normalise.py made them, with round()"""
+    counts: dict[str, Counter] = {}
+    for username, ticker, date in rows:
+        when = datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
+        minute_bin = (when.hour * 60 + round(when.minute / minutes) * minutes) % 1440
+        key = {"user": username, "ticker": ticker, "weekday": normalise.WEEKDAYS[when.weekday()], "all": ""}[by]
+        counts.setdefault(key, Counter())[minute_bin] += 1
+    return {key: dict(sorted(bins.items())) for key, bins in counts.items()}
+
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory: pytest.TempPathFactory) -> sqlite3.Connection:
+    db_name = str(tmp_path_factory.mktemp("db") / "posts.sqlite3")
+    fixtures.populate_db(db_name, 3000, days=60)
+    return sqlite3.connect(db_name)
+
+
+@pytest.mark.parametrize("by", ["user", "ticker", "weekday", "all"])
+@pytest.mark.parametrize("minutes", [5, 20, 60])
+def test_histograms_match_reference(conn: sqlite3.Connection, by: str, minutes: int) -> None:
+    rows = conn.execute("SELECT username, ticker, date FROM posts").fetchall()
+    assert normalise.histograms(conn, minutes, by) == reference(rows, minutes, by)
+
+
+@pytest.mark.parametrize(
+    "minutes, expected",
+    [
+        (60, {0: 1, 600: 2, 660: 2}),
+        (20, {600: 1, 640: 2, 700: 1, 1420: 1}),
+    ],
+)
+def test_histograms_round_half_to_even(tmp_path, minutes: int, expected: dict[int, int]) -> None:
+    # Halves: half past for 60 minute bins, ten, thirty and fifty past for 20
+    conn = dumplse.create_db(str(tmp_path / "posts.sqlite3"))
+    posts = [
+        dumplse.ChatPost("bob", "AFC", "1.00", "Buy", f"2024-03-29 {time}:00", "RE: x", time)
+        for time in ("10:10", "10:30", "10:50", "11:30", "23:50")
+    ]
+    dumplse.add_rows_to_db(conn, [dumplse.post_row(post.hash(), post) for post in posts])
+    assert normalise.histograms(conn, minutes, "all") == {"": expected}
+
+
+def test_histograms_top_and_days(conn: sqlite3.Connection) -> None:
+    since, until = datetime(2024, 1, 10), datetime(2024, 1, 20)
+    rows = conn.execute(
+        "SELECT username, ticker, date FROM posts WHERE date >= '2024-01-10' AND date < '2024-01-21'"
+    ).fetchall()
+    expected = reference(rows, 30, "ticker")
+    got = normalise.histograms(conn, 30, "ticker", since=since, until=until, top=3)
+
+    totals = {ticker: sum(bins.values()) for ticker, bins in expected.items()}
+    assert len(got) == 3
+    assert min(totals[ticker] for ticker in got) >= max(totals[ticker] for ticker in expected if ticker not in got)
+    assert got == {ticker: expected[ticker] for ticker in got}
+    assert normalise.histograms(conn, 30, "ticker", until=until, top=3, ticker=fixtures.TICKERS[0]).keys() == {fixtures.TICKERS[0]}
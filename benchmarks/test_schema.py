@@ -0,0 +1,52 @@
+import sqlite3
+
+import pytest
+
+import posts_schema
+
+V1_TABLE = """
+    CREATE TABLE posts
+    (hash TEXT PRIMARY KEY, username TEXT, ticker TEXT, atprice TEXT,
+    opinion TEXT, date TEXT, title TEXT, text TEXT)
+"""
+
+
+def v1_db(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute(V1_TABLE)
+        conn.execute(
+            "INSERT INTO posts VALUES ('a', 'bob', 'AFC', '1,234.50', 'Buy', '2024-03-29 15:32:00', 'RE: x', 'y')"
+        )
+    return conn
+
+
+def columns(conn: sqlite3.Connection) -> set[str]:
+    return {row[1] for row in conn.execute("PRAGMA table_info(posts)")}
+
+
+def test_failed_migration_rolls_back(tmp_path, monkeypatch) -> None:
+    conn = v1_db(str(tmp_path / "v1.sqlite3"))
+
+    def broken(price):
+        raise ValueError(price)
+
+    monkeypatch.setattr(posts_schema, "to_pence", broken)
+    with pytest.raises(sqlite3.Error):
+        posts_schema.ensure_schema(conn)
+    assert posts_schema.schema_version(conn) == 1
+    assert "epoch" not in columns(conn)
+
+    monkeypatch.undo()
+    assert posts_schema.ensure_schema(conn) == 1
+    assert posts_schema.schema_version(conn) == posts_schema.SCHEMA_VERSION
+    assert conn.execute("SELECT epoch, pence FROM posts").fetchone() == (1711726320, 1234.5)
+
+
+def test_half_migrated_db_migrates(tmp_path) -> None:
+    conn = v1_db(str(tmp_path / "v1.sqlite3"))
+    # What a migration that failed part way used to leave behind
+    conn.execute("ALTER TABLE posts ADD COLUMN epoch INTEGER")
+    assert posts_schema.ensure_schema(conn) == 1
+    assert {"epoch", "pence"} <= columns(conn)
+    assert posts_schema.ensure_schema(conn) == posts_schema.SCHEMA_VERSION
@@ -0,0 +1,23 @@
+import shutil
+import sqlite3
+
+import posts_schema
+import search_posts
+
+
+def test_search_finds_indexed_and_new_posts(posts_db: str, tmp_path) -> None:
+    db_name = str(tmp_path / "fts.sqlite3")
+    shutil.copy(posts_db, db_name)
+    conn = sqlite3.connect(db_name)
+    assert posts_schema.ensure_fts(conn)
+    assert not posts_schema.ensure_fts(conn)
+
+    found = search_posts.search_posts(conn, posts_schema.fts_phrase("big upside"), limit=1000)
+    expected = conn.execute("SELECT COUNT(*) FROM posts WHERE text LIKE '%big upside%'").fetchone()[0]
+    assert 0 < len(found) == min(expected, 1000)
+
+    # The triggers index posts saved after the index was built
+    with conn:
+        conn.execute("INSERT INTO posts (hash, username, ticker, title, text) VALUES ('x', 'zed', 'AFC', 'RE: xyzzy', 'plugh')")
+    assert [row[0] for row in search_posts.search_posts(conn, "plugh", ticker="afc")] == ["zed"]
+    assert search_posts.search_posts(conn, "plugh", user="someone") == []
@@ -0,0 +1,169 @@
+import shutil
+import sqlite3
+from datetime import timedelta
+
+import pytest
+
+import sentiment_analysis
+from posts_schema import ensure_fts, ensure_schema, from_epoch
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("bullish", "BULLISH"),
+        ("I am bullish", "BULLISH"),
+        ("bullish on this", "BULLISH"),
+        # As SQL's LIKE '% bullish' never did, with --newlines posts
+        ("I am bullish\n", None),
+        ("bullish\nnow", None),
+        ("I am BEARISH today", "BEARISH"),
+    ],
+)
+def test_terms_bounded_by_spaces(text: str, expected: str | None) -> None:
+    assert sentiment_analysis.classify_sentiment(text)[0] == expected
+
+
+def test_bench_sentiment(benchmark, posts_db: str) -> None:
+    accuracy_stats, results = benchmark.pedantic(
+        sentiment_analysis.analyze_sentiment_predictions,
+        kwargs={"db_path": posts_db, "end_date": "2024-12"},
+        rounds=1,
+    )
+    benchmark.extra_info["predictions_scored"] = len(results)
+    assert results
+
+
+def test_stream_matches_analyze(posts_db: str) -> None:
+    accuracy_stats, results = sentiment_analysis.analyze_sentiment_predictions(posts_db, end_date="2024-12")
+    streamed, examples = sentiment_analysis.stream_sentiment_predictions(posts_db, end_date="2024-12", top_n=3)
+    assert streamed == accuracy_stats
+    for username in {result["username"] for result in results}:
+        assert examples[username] == sentiment_analysis.get_top_predictions(results, username, 3)
+
+
+def test_bench_sentiment_stream(benchmark, posts_db: str) -> None:
+    accuracy_stats, examples = benchmark.pedantic(
+        sentiment_analysis.stream_sentiment_predictions,
+        kwargs={"db_path": posts_db, "end_date": "2024-12"},
+        rounds=1,
+    )
+    assert accuracy_stats
+
+
+def test_jobs_match_serial(posts_db: str) -> None:
+    serial = sentiment_analysis.analyze_sentiment_predictions(posts_db, end_date="2024-12")
+    parallel = sentiment_analysis.analyze_sentiment_predictions(posts_db, end_date="2024-12", jobs=3)
+    assert repr(parallel[0]) == repr(serial[0])
+    assert parallel[1] == serial[1]
+
+
+def reference_results(predictions: list[tuple], db_path: str, start_day: int, end_day: int, threshold_pct: float) -> list[dict]:
+    """The per post loop score_predictions replaced, over the same predictions"""
+    conn = sqlite3.connect(db_path)
+    prices = {}
+    for epoch, price, ticker_name in conn.execute(
+        "SELECT epoch, pence, ticker FROM posts WHERE pence IS NOT NULL AND epoch IS NOT NULL ORDER BY epoch, rowid"
+    ):
+        prices[(from_epoch(epoch).date(), ticker_name)] = price
+    conn.close()
+
+    results = []
+    for username, pred_price, pred_epoch, sentiment, text_sample, ticker, spans in predictions:
+        pred_date = from_epoch(pred_epoch).date()
+        future_prices = []
+        threshold_date = None
+        for i in range(start_day, end_day + 1):
+            future_date = pred_date + timedelta(days=i)
+            if (future_date, ticker) in prices:
+                price = float(prices[(future_date, ticker)])
+                future_prices.append(price)
+                if not threshold_date:
+                    if sentiment == "BULLISH" and price > float(pred_price) * (1 + threshold_pct):
+                        threshold_date = future_date
+                    elif sentiment == "BEARISH" and price < float(pred_price) * (1 - threshold_pct):
+                        threshold_date = future_date
+
+        if len(future_prices) >= 3:
+            avg_future_price = sum(future_prices) / len(future_prices)
+            price_change_pct = (avg_future_price - float(pred_price)) / float(pred_price) * 100
+            correct = False
+            if sentiment == "BULLISH" and avg_future_price > float(pred_price) * (1 + threshold_pct):
+                correct = True
+            elif sentiment == "BEARISH" and avg_future_price < float(pred_price) * (1 - threshold_pct):
+                correct = True
+            results.append({
+                "username": username,
+                "pred_price": float(pred_price),
+                "pred_date": pred_date,
+                "sentiment": sentiment,
+                "avg_future_price": avg_future_price,
+                "price_change_pct": price_change_pct,
+                "correct": correct,
+                "ticker": ticker,
+                "text_sample": text_sample,
+                "spans": spans,
+                "threshold_date": threshold_date,
+            })
+    return results
+
+
+@pytest.mark.parametrize("threshold_pct, day_range", [(0.2, "3-14"), (0.05, "1-7"), (0.0, "0-30"), (0.5, "10-12")])
+def test_scoring_matches_reference(posts_db: str, threshold_pct: float, day_range: str) -> None:
+    start_day, end_day = map(int, day_range.split("-"))
+    predictions, series = sentiment_analysis.load_predictions(posts_db, end_date="2024-12")
+    results = sentiment_analysis.score_predictions(predictions, series, start_day, end_day, threshold_pct)
+    expected = reference_results(predictions, posts_db, start_day, end_day, threshold_pct)
+    assert results
+    assert results == expected
+    # Plain Python values, not numpy ones that happen to compare equal
+    assert [{k: type(v) for k, v in r.items()} for r in results] == [{k: type(v) for k, v in r.items()} for r in expected]
+
+
+@pytest.mark.parametrize("fts", [False, True])
+def test_keyword_changes_reclassify(posts_db: str, tmp_path, monkeypatch, fts: bool) -> None:
+    db_name = str(tmp_path / "posts.sqlite3")
+    shutil.copy(posts_db, db_name)
+    conn = sqlite3.connect(db_name)
+    ensure_schema(conn)
+    if fts:
+        ensure_fts(conn)
+    sentiment_analysis.update_sentiment(conn)
+
+    def sentiments() -> dict[str, tuple]:
+        return {row[0]: row[1:] for row in conn.execute("SELECT hash, sentiment, positive, negative FROM sentiment")}
+
+    before = sentiments()
+    # "dividend" is in the fixtures' filler, so plenty of posts change
+    positive = sentiment_analysis.POSITIVE | {"dividend"}
+    negative = sentiment_analysis.NEGATIVE - {sorted(sentiment_analysis.NEGATIVE)[0]}
+    monkeypatch.setattr(sentiment_analysis, "POSITIVE", positive)
+    monkeypatch.setattr(sentiment_analysis, "NEGATIVE", negative)
+    monkeypatch.setattr(sentiment_analysis, "POSITIVE_RE", sentiment_analysis.compile_terms(positive))
+    monkeypatch.setattr(sentiment_analysis, "NEGATIVE_RE", sentiment_analysis.compile_terms(negative))
+    sentiment_analysis.update_sentiment(conn)
+
+    # Just as if every post was classified from scratch with the new keywords
+    expected = {
+        post_hash: (sentiment, positive, negative)
+        for sentiment, positive, negative, post_hash in sentiment_analysis.classify_rows(conn.execute("SELECT hash, text FROM posts"))
+    }
+    assert sentiments() == expected != before
+    assert conn.execute("SELECT DISTINCT version FROM sentiment").fetchall() == [(sentiment_analysis.keywords_version(),)]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_sweep_matches_single_runs(posts_db: str, jobs: int) -> None:
+    thresholds, day_ranges = (0.05, 0.2), ("1-7", "3-14")
+    user_names, cells = sentiment_analysis.sweep_sentiment_predictions(
+        posts_db, end_date="2024-12", thresholds=thresholds, day_ranges=day_ranges, jobs=jobs
+    )
+    assert set(cells) == {(t, r) for t in thresholds for r in day_ranges}
+    for (threshold_pct, day_range), (total, right) in cells.items():
+        _, results = sentiment_analysis.analyze_sentiment_predictions(
+            posts_db, end_date="2024-12", threshold_pct=threshold_pct, day_range=day_range
+        )
+        assert sum(total) == len(results)
+        for i, name in enumerate(user_names):
+            mine = [r for r in results if r["username"] == name]
+            assert (total[i], right[i]) == (len(mine), sum(r["correct"] for r in mine))
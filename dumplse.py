@@ -2,21 +2,42 @@
 """Dump chat messages for a given www.lse.co.uk user or ticker"""
 import argparse
 # import asyncio
+import csv
+import gzip
+import heapq
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import re
 import sqlite3
 import sys
+import threading
 import time
 # import ast
-from bs4 import BeautifulSoup
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+from collections import deque
 from colorama import Fore
-from dataclasses import dataclass
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing, nullcontext
+from dataclasses import dataclass, field
 from datetime import datetime
 from halo import Halo
 from hashlib import sha256
-from random import randrange
+from queue import Queue
+from random import uniform
+from requests.adapters import HTTPAdapter
+from typing import Any, Generator, Iterator, TextIO
+from zoneinfo import ZoneInfo
+
+from metrics import Metrics
+from posts_schema import ensure_fts, ensure_schema, to_epoch, to_pence
 
 import undetected_chromedriver as uc
 from selenium_stealth import stealth
-from selenium.common.exceptions import InvalidSessionIdException
+from selenium.common.exceptions import InvalidSessionIdException, TimeoutException
 
 
 def get_arguments() -> argparse.Namespace:
@@ -25,6 +46,12 @@ def get_arguments() -> argparse.Namespace:
     group = parser.add_mutually_exclusive_group()
     group.add_argument("--user", "-u", help="Dump user", type=str)
     group.add_argument("--ticker", "-t", help="Dump ticker", type=str)
+    group.add_argument(
+        "--batch",
+        "-b",
+        help="Dump every 'ticker XYZ' or 'user name' line in a file ('-' for stdin)",
+        type=str,
+    )
     parser.add_argument(
         "--posts_max",
         "-p",
@@ -35,7 +62,7 @@ def get_arguments() -> argparse.Namespace:
     parser.add_argument(
         "--page",
         "-P",
-        help="The page to start from",
+        help=f"The page to start from, of {CHAT_PAGE_SIZE} posts a page",
         type=int,
         default=1,
     )
@@ -51,13 +78,97 @@ def get_arguments() -> argparse.Namespace:
         help="Save viewed posts to SQLiteDB, dont show posts again",
         action="store_true",
     )
+    parser.add_argument(
+        "--incremental",
+        "-i",
+        help="With --save, stop once we reach posts saved by the last complete run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fts",
+        help="With --save, keep a full text index of posts for search_posts.py",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--watch",
+        "-w",
+        help="With --save, keep polling for new posts, busy chats more often than quiet ones",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--archive",
+        "-a",
+        help="Keep a gzipped copy of every page fetched in this directory",
+        type=str,
+    )
+    parser.add_argument(
+        "--replay",
+        help="Re-read pages kept in --archive, rather than fetching from LSE",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--backend",
+        help="How to fetch pages, 'auto' only starts Chrome if we hit a bot wall",
+        choices=["auto", "requests", "chrome"],
+        default="auto",
+    )
+    parser.add_argument(
+        "--lean",
+        help="Run Chrome without images, styles, fonts or trackers, and only read the chat from it",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--chrome-profile",
+        help="Keep Chrome's profile (and cookies) in this directory, to reuse next time",
+        type=str,
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        help="Number of pages to fetch in flight at once",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--parse-jobs",
+        help="Number of processes parsing pages, while others are fetched",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--format",
+        "-f",
+        help="Print posts as coloured text, or one JSON object per line, or CSV",
+        choices=PostWriter.FORMATS,
+        default="text",
+    )
+    parser.add_argument(
+        "--stats",
+        help="Print how long each stage of the crawl took at the end",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="Write crawl metrics to this JSON file at the end (and after each --watch poll)",
+        type=str,
+    )
+    parser.add_argument(
+        "--prometheus",
+        help="Serve crawl metrics for Prometheus on this port, at /metrics",
+        type=int,
+    )
     parser.add_argument(
         "--debug", "-d", help="Print posts with repr", action="store_true"
     )
     _arg = parser.parse_args()
-    if len(sys.argv) == 1:
+    if _arg.replay and not _arg.archive:
+        # pylint: disable=raising-bad-type
+        raise parser.error("replay needs an archive to read pages from")
+    if len(sys.argv) == 1 or not (
+        _arg.user or _arg.ticker or _arg.batch or _arg.replay
+    ):
         # pylint: disable=raising-bad-type
-        raise parser.error("you must specify either user or ticker")
+        raise parser.error("you must specify either user, ticker or batch")
     if _arg.page and (_arg.page < 1 or _arg.page > 4096):
         # pylint: disable=raising-bad-type
         raise parser.error("page value must be between 1 and 4096")
@@ -65,14 +176,156 @@ def get_arguments() -> argparse.Namespace:
         # Default 25 posts per page, max pages ~= 4096, ergo ~82k
         # pylint: disable=raising-bad-type
         raise parser.error("posts value must be between 1 and 131072")
+    if _arg.incremental and not _arg.save:
+        # pylint: disable=raising-bad-type
+        raise parser.error("incremental needs save, to know what we've seen")
+    if _arg.fts and not _arg.save:
+        # pylint: disable=raising-bad-type
+        raise parser.error("fts needs save, to have posts to index")
+    if _arg.watch and not _arg.save:
+        # pylint: disable=raising-bad-type
+        raise parser.error("watch needs save, to know which posts are new")
+    if _arg.watch and _arg.replay:
+        # pylint: disable=raising-bad-type
+        raise parser.error("watch polls LSE, it can't replay an archive")
+    if _arg.jobs < 1 or _arg.jobs > 16:
+        # pylint: disable=raising-bad-type
+        raise parser.error("jobs value must be between 1 and 16")
+    if _arg.parse_jobs < 1 or _arg.parse_jobs > (os.cpu_count() or 1):
+        # pylint: disable=raising-bad-type
+        raise parser.error(f"parse jobs value must be between 1 and {os.cpu_count() or 1}")
     if _arg.user:
         _arg.user = _arg.user.lower()
     if _arg.ticker:
         _arg.ticker = _arg.ticker.upper()
+    if _arg.batch:
+        try:
+            _arg.targets = read_batch(_arg.batch)
+        except (OSError, ValueError) as e:
+            # pylint: disable=raising-bad-type
+            raise parser.error(f"can't read batch file {_arg.batch} : {e}")
+    elif _arg.user or _arg.ticker:
+        _arg.targets = [(_arg.user, _arg.ticker)]
+    else:
+        # Replay everything we have archived
+        _arg.targets = archived_targets(_arg.archive)
 
     return _arg
 
 
+def read_batch(path: str) -> list[tuple[str | None, str | None]]:
+    """
+    Read (user, ticker) targets from a batch file, one per line, eg.
+        ticker AFC
+        user tomtastic
+    Blank lines and lines starting with # are ignored
+    """
+    targets: list[tuple[str | None, str | None]] = []
+    with sys.stdin if path == "-" else open(path, "r") as batch:
+        for line_num, line in enumerate(batch, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            kind, _, name = line.partition(" ")
+            name = name.strip()
+            if kind in ("ticker", "t") and name:
+                targets.append((None, name.upper()))
+            elif kind in ("user", "u") and name:
+                targets.append((name.lower(), None))
+            else:
+                raise ValueError(f"line {line_num} isn't 'ticker XYZ' or 'user name'")
+    return targets
+
+
+def target_name(arg: argparse.Namespace) -> str:
+    """Returns a key naming the user or ticker in arg, eg. 'ticker:AFC'"""
+    if arg.user:
+        return "user:" + arg.user
+    return "ticker:" + arg.ticker
+
+
+ARCHIVE_SUFFIX = ".html.gz"
+ARCHIVE_TIME = "%Y%m%d-%H%M%S"
+
+
+def archive_dir(arg: argparse.Namespace) -> str:
+    """Returns where pages for the user or ticker in arg are archived"""
+    return os.path.join(arg.archive, target_name(arg).replace(":", "_", 1))
+
+
+def archive_page(arg: argparse.Namespace, page_num: int, page: str) -> None:
+    """
+    Keep a gzipped copy of a fetched page, in a directory for the crawl it's
+    part of (named for when that started), named for its page number and
+    when it was fetched, eg.
+    archive/ticker_AFC/20240329-153000/0001-20240329-153200.html.gz
+    """
+    path = os.path.join(archive_dir(arg), arg.crawl_started.strftime(ARCHIVE_TIME))
+    name = f"{page_num:04d}-{datetime.now().strftime(ARCHIVE_TIME)}{ARCHIVE_SUFFIX}"
+    try:
+        os.makedirs(path, exist_ok=True)
+        with gzip.open(os.path.join(path, name), "wt", encoding="utf8") as archived:
+            archived.write(page)
+    except OSError as e:
+        print(f"\r{Fore.RED}[!] Error archiving page {page_num}: {e}{Fore.RESET}", file=sys.stderr)
+
+
+def archived_pages(arg: argparse.Namespace) -> Iterator[tuple[datetime, int, str]]:
+    """
+    Yield (fetch time, page number, path) of archived pages, a crawl at a
+    time, oldest first, each in page order however its fetches finished
+    """
+    path = archive_dir(arg)
+    if not os.path.isdir(path):
+        return
+    names = sorted(os.listdir(path))
+    # Archives from before pages were kept per crawl, named
+    # <fetch time>-<page>.html.gz, go first in the order they always did
+    for name in names:
+        if not name.endswith(ARCHIVE_SUFFIX):
+            continue
+        stamp, _, page_num = name[: -len(ARCHIVE_SUFFIX)].rpartition("-")
+        try:
+            fetched = datetime.strptime(stamp, ARCHIVE_TIME)
+        except ValueError:
+            continue
+        yield fetched, int(page_num), os.path.join(path, name)
+    for crawl in names:
+        crawl_path = os.path.join(path, crawl)
+        if not os.path.isdir(crawl_path):
+            continue
+        for name in sorted(os.listdir(crawl_path)):
+            if not name.endswith(ARCHIVE_SUFFIX):
+                continue
+            page_num, _, stamp = name[: -len(ARCHIVE_SUFFIX)].partition("-")
+            try:
+                fetched = datetime.strptime(stamp, ARCHIVE_TIME)
+            except ValueError:
+                continue
+            yield fetched, int(page_num), os.path.join(crawl_path, name)
+
+
+def archived_targets(archive: str) -> list[tuple[str | None, str | None]]:
+    """Returns the (user, ticker) targets we have archived pages for"""
+    targets: list[tuple[str | None, str | None]] = []
+    if not os.path.isdir(archive):
+        return targets
+    for name in sorted(os.listdir(archive)):
+        kind, _, target = name.partition("_")
+        if kind == "ticker":
+            targets.append((None, target))
+        elif kind == "user":
+            targets.append((target, None))
+    return targets
+
+
+def target_url(arg: argparse.Namespace) -> str:
+    """Returns the chat URL for the user or ticker in arg, less the page number"""
+    if arg.user:
+        return "https://www.lse.co.uk/profiles/" + arg.user + "/?page="
+    return "https://www.lse.co.uk/ShareChat.asp?ShareTicker=" + arg.ticker + "&page="
+
+
 @dataclass
 class ChatPost:
     """Object describing a chat post"""
@@ -84,6 +337,7 @@ class ChatPost:
     date: str
     title: str
     text: str
+    _hash: str | None = field(default=None, init=False, repr=False, compare=False)
 
     def __str__(self) -> str:
         """Magic-method to pretty-print our object"""
@@ -115,33 +369,91 @@ class ChatPost:
         )
 
     def hash(self) -> str:
-        hash = sha256()
-        hash.update(bytes(self.date + self.username + self.title + self.text, "utf8"))
-        return hash.hexdigest()
+        # Only worked out once, none of the hashed fields change after parsing
+        if self._hash is None:
+            hash = sha256()
+            hash.update(bytes(self.date + self.username + self.title + self.text, "utf8"))
+            self._hash = hash.hexdigest()
+        return self._hash
+
+
+class SeenFilter:
+    """
+    Bloom filter over the hashes of saved posts, so most new posts can be
+    ruled out without asking the database. A miss means never seen, a hit
+    only means maybe, so hits still get checked against the database.
+    """
+
+    # ~1% false positives at 10 bits per post with 7 probes
+    BITS_PER_POST = 10
+    PROBES = 7
+
+    def __init__(self, capacity: int) -> None:
+        self.size = max(capacity * self.BITS_PER_POST, 1 << 16)
+        self.bits = bytearray(self.size // 8 + 1)
+
+    def probes(self, hash: str) -> list[int]:
+        # Post hashes are sha256 hex digests, so slices of them are already
+        # well spread, no need to hash them again
+        return [int(hash[i * 8 : i * 8 + 8], 16) % self.size for i in range(self.PROBES)]
+
+    def add(self, hash: str) -> None:
+        for bit in self.probes(hash):
+            self.bits[bit >> 3] |= 1 << (bit & 7)
+
+    def __contains__(self, hash: str) -> bool:
+        return all(self.bits[bit >> 3] & (1 << (bit & 7)) for bit in self.probes(hash))
+
+
+class PostsConnection(sqlite3.Connection):
+    """An SQLite3 connection which carries a SeenFilter of the saved posts"""
+
+    seen: SeenFilter | None = None
 
+    def load_seen(self) -> None:
+        """Build the SeenFilter from every post hash in the database"""
+        (count,) = self.execute("SELECT COUNT(*) FROM posts").fetchone()
+        # Leave room for this run's posts before the filter gets crowded
+        seen = SeenFilter(2 * count + 65536)
+        for (hash,) in self.execute("SELECT hash FROM posts"):
+            seen.add(hash)
+        self.seen = seen
 
-def create_db(db_name: str) -> sqlite3.Connection:
-    """Creates an SQLite3 database file containing hashes of posts we've seen"""
-    conn = sqlite3.connect(db_name)
+
+def create_db(db_name: str, fts: bool = False) -> sqlite3.Connection:
+    """
+    Creates an SQLite3 database file containing hashes of posts we've seen,
+    with the full text index if fts (once there, it's kept up to date anyway)
+    """
+    conn = sqlite3.connect(db_name, factory=PostsConnection)
     cursor = conn.cursor()
     try:
+        # WAL lets readers (eg. sentiment_analysis.py) carry on while we write,
+        # and with synchronous=NORMAL we only fsync at checkpoints
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-16000")
+        # Creates the posts table, or migrates an older one
+        ensure_schema(conn)
+        if fts:
+            ensure_fts(conn)
+        # The newest post we saw on page 1 of each user or ticker last time
         cursor.execute(
             """
-            CREATE TABLE IF NOT EXISTS posts
-            (hash TEXT PRIMARY KEY,
-            username TEXT,
-            ticker TEXT,
-            atprice TEXT,
-            opinion TEXT,
+            CREATE TABLE IF NOT EXISTS checkpoints
+            (target TEXT PRIMARY KEY,
+            hash TEXT,
             date TEXT,
-            title TEXT,
-            text TEXT)
+            updated TEXT)
         """
         )
         conn.commit()
+        conn.load_seen()
     except sqlite3.Error as e:
         conn.rollback()
-        print(f"\rError creating posts table in database : {e}")
+        print(f"\rError creating posts table in database : {e}", file=sys.stderr)
+        sys.exit(1)
     finally:
         cursor.close()
     return conn
@@ -149,38 +461,140 @@ def create_db(db_name: str) -> sqlite3.Connection:
 
 def exists_in_db(conn: sqlite3.Connection, hash: str) -> bool:
     """Check if a post hash exists in the database"""
+    return hash in seen_in_db(conn, [hash])
+
+
+def seen_in_db(conn: sqlite3.Connection, hashes: list[str]) -> set[str]:
+    """Returns which of the given post hashes already exist in the database"""
+    # Stay well under SQLite's limit on the number of host parameters
+    CHUNK = 500
+    seen: set[str] = set()
+    seen_filter = getattr(conn, "seen", None)
+    if seen_filter is not None:
+        # Only the maybes need looking up
+        hashes = [hash for hash in hashes if hash in seen_filter]
     cursor = conn.cursor()
     try:
-        rows = cursor.execute(f'SELECT * FROM posts WHERE hash = "{hash}"').fetchall()
-        if len(rows) >= 1:
-            return True
+        for i in range(0, len(hashes), CHUNK):
+            chunk = hashes[i : i + CHUNK]
+            rows = cursor.execute(
+                f"SELECT hash FROM posts WHERE hash IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            seen.update(row[0] for row in rows)
     except sqlite3.Error as e:
-        print(f"\rError checking hash of post in database : {e}")
+        print(f"\rError checking hash of post in database : {e}", file=sys.stderr)
     finally:
         cursor.close()
-    return False
+    return seen
+
+
+def get_checkpoint(conn: sqlite3.Connection, target: str) -> str | None:
+    """Returns the hash of the newest post we saw for target last time"""
+    try:
+        row = conn.execute(
+            "SELECT hash FROM checkpoints WHERE target = ?", (target,)
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"\rError reading checkpoint for {target} from database : {e}", file=sys.stderr)
+        return None
+    return row[0] if row else None
+
+
+def set_checkpoint(conn: sqlite3.Connection, target: str, p: ChatPost) -> None:
+    """Remember p as the newest post we've seen for target"""
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (target, hash, date, updated) VALUES (?, ?, ?, ?)",
+                (target, p.hash(), p.date, str(datetime.now())),
+            )
+    except sqlite3.Error as e:
+        print(f"\r[!] Error saving checkpoint for {target} to database : {e}", file=sys.stderr)
+
+
+def post_row(hash: str, p: ChatPost) -> tuple:
+    """The posts table row for a post, take this before printing it"""
+    return (
+        hash,
+        p.username,
+        p.ticker,
+        p.atprice,
+        p.opinion,
+        p.date,
+        p.title,
+        p.text,
+        to_epoch(p.date),
+        to_pence(p.atprice),
+    )
 
 
 def add_to_db(conn: sqlite3.Connection, hash: str, p: ChatPost) -> None:
     """Add a hash of a seen post to the database"""
-    cursor = conn.cursor()
+    add_rows_to_db(conn, [post_row(hash, p)])
+
+
+def add_rows_to_db(conn: sqlite3.Connection, rows: list[tuple]) -> None:
+    """Add many post rows to the database in a single transaction"""
     try:
-        cursor.execute(
-            "INSERT INTO posts (hash, username, ticker, atprice, opinion, date, title, text) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (hash, p.username, p.ticker, p.atprice, p.opinion, p.date, p.title, p.text),
-        )
-        conn.commit()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO posts (hash, username, ticker, atprice, opinion, date, title, text, epoch, pence) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        seen_filter = getattr(conn, "seen", None)
+        if seen_filter is not None:
+            for row in rows:
+                seen_filter.add(row[0])
     except sqlite3.OperationalError as e:
-        print(f"\r[!] Error adding hash of post {repr(p)} to database : {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
+        print(f"\r[!] Error adding {len(rows)} posts to database : {e}", file=sys.stderr)
+
+
+# Only the parts of a page we ever look at: the chat posts, LSE's alerts and
+# the pager links. Everything else on the page is skipped while parsing.
+PAGE_CLASSES = {
+    "share-chat-message__message-content",
+    "alert",
+    "alert__list-item",
+    "pager__link",
+}
+
 
+# The same parts, read straight out of Chrome's DOM (a lean Chrome hands us
+# just these, rather than the whole page), leaving out any inside another
+PAGE_SELECTOR = ", ".join(f".{name}" for name in sorted(PAGE_CLASSES))
+EXTRACT_SCRIPT = f"""
+    const selector = "{PAGE_SELECTOR}";
+    const parts = Array.from(document.querySelectorAll(selector))
+        .filter(e => !(e.parentElement && e.parentElement.closest(selector)))
+        .map(e => e.outerHTML);
+    return "<html><body>" + parts.join("") + "</body></html>";
+"""
 
-def get_posts_from_page(soup: BeautifulSoup, arg: argparse.Namespace) -> list:
+
+def wanted_class(value: str | None) -> bool:
+    # Newer bs4 hands us the raw "a b" class attribute while parsing,
+    # older versions each class in turn, so split it ourselves
+    return value is not None and not PAGE_CLASSES.isdisjoint(value.split())
+
+
+PAGE_STRAINER = SoupStrainer(class_=wanted_class)
+# Tags holding the fields of a post, see msg in get_posts_from_page
+FIELD_TAGS = ["p", "div", "span"]
+
+
+def parse_page(page: str) -> BeautifulSoup:
+    """Parse the HTML source of a chat page, keeping only the bits we use"""
+    return BeautifulSoup(page, "html.parser", parse_only=PAGE_STRAINER)
+
+
+def get_posts_from_page(
+    soup: BeautifulSoup, arg: argparse.Namespace, fetched: datetime | None = None
+) -> list:
     """
     Returns a list of chat message objects from a beautiful soup page object
     (optional) ticker_symbol argument, hints we're parsing all posts for a given share
+    (optional) fetched, when the page was fetched, so we know what "Today" was
     """
 
     def string_to_datetime(post_time: str) -> str:
@@ -188,21 +602,21 @@ def get_posts_from_page(soup: BeautifulSoup, arg: argparse.Namespace) -> list:
         if "Today" in str(post_time):
             # "Today 15.32"
             time = str(post_time)[6:]
-            todays_date = datetime.today().strftime("%d %b %Y")
+            todays_date = (fetched or datetime.today()).strftime("%d %b %Y")
             post_time = str(todays_date) + " " + str(time)
 
         try:
             # "29 Mar 2024 15:32"
-            post_time = datetime.strptime(post_time, "%d %b %Y %H:%M")
+            return str(datetime.strptime(post_time, "%d %b %Y %H:%M"))
         except:
-            print(f"\r[!] Something went wrong parsing {post_time}")
+            print(f"\r[!] Something went wrong parsing {post_time}", file=sys.stderr)
             pass
 
         return str(post_time)
 
     page_posts: list[ChatPost] = []
 
-    msg = {
+    msg: dict[str, Any] = {
         "class": "share-chat-message__message-content",
         "name": {"tag": "p", "class": "share-chat-message__details--username"},
         "details": {"tag": "p", "class": "share-chat-message__details"},
@@ -226,14 +640,27 @@ def get_posts_from_page(soup: BeautifulSoup, arg: argparse.Namespace) -> list:
         return page_posts
 
     for post in post_elems:
-        elem = {}
-        elem["name"] = post.find(
-            name=msg["name"]["tag"], attrs=msg["name"]["class"]
-        ).getText()
-        # details element contains {share name, opinion, share price at date of posting}
-        elem["details"] = post.find_all(
-            msg["details"]["tag"], attrs=msg["details"]["class"]
-        )
+        # Pick out every field in one walk of the post, rather than a find()
+        # per field. First match wins, same as find() would give us.
+        elem: dict[str, Any] = {"name": None, "details": [], "title": None, "date": None, "text": None}
+        for tag in post.find_all(FIELD_TAGS):
+            classes = tag.get("class") or ()
+            if tag.name == msg["name"]["tag"] and msg["name"]["class"] in classes:
+                if elem["name"] is None:
+                    elem["name"] = tag.getText()
+            # details element contains {share name, opinion, share price at date of posting}
+            if tag.name == msg["details"]["tag"] and msg["details"]["class"] in classes:
+                elem["details"].append(tag)
+            if tag.name == msg["title"]["tag"] and msg["title"]["class"] in classes:
+                if elem["title"] is None:
+                    elem["title"] = tag
+            if tag.name == msg["date"]["tag"] and msg["date"]["class"] in classes:
+                if elem["date"] is None:
+                    elem["date"] = tag.getText()
+            if tag.name == msg["text"]["tag"] and msg["text"]["class"] in classes:
+                if elem["text"] is None:
+                    elem["text"] = tag
+
         if arg.ticker:
             _ticker = arg.ticker
             elem["price"] = elem["details"][2]
@@ -243,11 +670,6 @@ def get_posts_from_page(soup: BeautifulSoup, arg: argparse.Namespace) -> list:
             elem["price"] = elem["details"][3]
             elem["opinion"] = elem["details"][4]
 
-        elem["title"] = post.find(msg["title"]["tag"], attrs=msg["title"]["class"])
-        elem["date"] = post.find(
-            msg["date"]["tag"], attrs=msg["date"]["class"]
-        ).getText()
-        elem["text"] = post.find(msg["text"]["tag"], attrs=msg["text"]["class"])
         if arg.newlines:
             for br_tag in elem["text"].find_all("br"):
                 br_tag.replace_with("\n" + br_tag.text)
@@ -311,14 +733,100 @@ def detect_alerts(soup: BeautifulSoup, arg: argparse.Namespace) -> bool:
     return got_alert
 
 
-def gen_driver() -> uc.Chrome | None:
+# The page number in a pager link, eg. ShareChat.html?ShareTicker=AFC&page=3
+PAGE_NUMBER = re.compile(r"[?&]page=(\d+)")
+
+
+def pager_last_page(soup: BeautifulSoup, page_num: int) -> tuple[int, bool]:
+    """
+    Returns the highest page the pager on page page_num links to, and whether
+    that's the last page of the chat: it is if there's no next link to follow
+    (LSE points the next link back at the current page on the last one), or
+    if the pager skips ahead to it, eg. 1 2 3 ... 57 Next
+    """
+    has_next = False
+    numbers = {page_num}
+    for link in soup.find_all("a", class_="pager__link"):
+        classes = link.get_attribute_list("class")
+        number = PAGE_NUMBER.search(str(link.get("href", "")))
+        if "pager__link--next" in classes:
+            has_next = "pager__link--disabled" not in classes and (
+                number is None or int(number.group(1)) > page_num
+            )
+        elif number is not None:
+            numbers.add(int(number.group(1)))
+    if not has_next:
+        return page_num, True
+    last, *below = sorted(numbers, reverse=True)
+    return last, bool(below) and last - below[0] > 1
+
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.6167.140 Safari/537.36"
+# LSE shows 25 chat posts a page unless this cookie asks for more, 50 is the
+# most it offers, so we need half as many pages
+CHAT_PAGE_SIZE = 50
+PAGE_SIZE_COOKIE = {"name": "chat_page_size", "value": str(CHAT_PAGE_SIZE), "domain": ".lse.co.uk", "path": "/"}
+
+
+def gen_session(pool_size: int = 4) -> requests.Session:
+    """Create a keep-alive HTTP session which looks enough like our Chrome driver"""
+    session = requests.Session()
+    session.headers.update(
+        {
+            "User-Agent": USER_AGENT,
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "en-US,en;q=0.9",
+            "Accept-Encoding": "gzip, deflate",
+        }
+    )
+    session.cookies.set(**PAGE_SIZE_COOKIE)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# What a lean Chrome doesn't fetch: everything but the page and its scripts,
+# and the ad and tracking scripts too
+BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.css", "*.woff", "*.woff2", "*.ttf", "*.otf", "*.mp4", "*.webm",
+    "*doubleclick.net*", "*googlesyndication.com*", "*googletagmanager.com*",
+    "*google-analytics.com*", "*adservice.google.*", "*amazon-adsystem.com*",
+    "*facebook.net*", "*scorecardresearch.com*", "*quantserve.com*",
+    "*taboola.com*", "*outbrain.com*", "*criteo.com*", "*adnxs.com*",
+]
+
+
+def gen_driver(arg: argparse.Namespace | None = None) -> uc.Chrome | None:
+    """
+    Start a headless Chrome, lean (see BLOCKED_URLS) if arg.lean, keeping its
+    profile in arg.chrome_profile if given so the next run starts warm
+    """
+    lean = arg is not None and arg.lean
+    profile = arg.chrome_profile if arg is not None else None
     try:
-        user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.6167.140 Safari/537.36"
+        user_agent = USER_AGENT
         chrome_options = uc.ChromeOptions()
         chrome_options.add_argument('--headless=new')
-        chrome_options.add_argument("--start-maximized")
         chrome_options.add_argument("user-agent={}".format(user_agent))
-        driver = uc.Chrome(options=chrome_options)
+        if lean:
+            # Hand the page back once its HTML is in, not after every last
+            # image and script has loaded
+            chrome_options.page_load_strategy = "eager"
+            chrome_options.add_argument("--window-size=1280,800")
+            chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+            chrome_options.add_argument("--disable-extensions")
+            chrome_options.add_argument("--mute-audio")
+        else:
+            chrome_options.add_argument("--start-maximized")
+        if profile:
+            os.makedirs(profile, exist_ok=True)
+        driver = uc.Chrome(options=chrome_options, user_data_dir=profile)
+        driver.execute_cdp_cmd("Network.setCookie", PAGE_SIZE_COOKIE)
+        if lean:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
         stealth(driver,
                 languages=["en-US", "en"],
                 vendor="Google Inc.",
@@ -332,108 +840,669 @@ def gen_driver() -> uc.Chrome | None:
             sys.exit(1)
         return driver
     except Exception as e:
-        print("Error in Driver: ",e)
+        print("Error in Driver: ",e, file=sys.stderr)
         return None
 
 
-@Halo(text="Dumping", spinner="dots")
+# Every stage of the crawl reports here, from whichever thread it runs in
+METRICS = Metrics()
+
+
+class Pacer:
+    """
+    Space out the start of page requests, shared by every worker and target,
+    so running more jobs overlaps the waiting without hammering the LSE server:
+    however many jobs there are, they take turns within the one rate
+
+    Requests take tokens from a bucket refilled at rate per second. The rate
+    starts where the old random pauses of up to pause_max seconds averaged
+    out, creeps up to twice that while pages come back quickly, and halves
+    whenever LSE slows down, errors or shows us an alert. Failed requests are
+    retried after a jittered exponential backoff, until the run's retry
+    budget is spent.
+    """
+
+    # Retries allowed per run, on top of one for every RETRY_EVERY requests
+    RETRY_BUDGET = 10
+    RETRY_EVERY = 20
+    BACKOFF_BASE = 2.0
+    BACKOFF_MAX = 120.0
+    # A page taking this many times longer than usual means LSE is struggling
+    SLOW_FACTOR = 2.0
+
+    def __init__(self, pause_max: int) -> None:
+        self.start_rate = 1 / max(1.0, (pause_max - 1) / 2)
+        self.rate = self.start_rate
+        self.max_rate = self.start_rate * 2
+        self.min_rate = self.start_rate / 10
+        self.burst = 1.0
+        self.tokens = self.burst
+        self.refilled = time.monotonic()
+        # Fast and slow moving averages of how long pages take
+        self.latency: float | None = None
+        self.usual_latency: float | None = None
+        self.requests = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def wait(self, arg: argparse.Namespace) -> None:
+        """Block until we're allowed to start another request"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+            self.refilled = now
+            # Take a token, going into debt if there isn't one, and wait
+            # until the debt's paid off, give or take some jitter
+            self.tokens -= 1
+            delay = max(0.0, -self.tokens / self.rate)
+            if delay > 0:
+                delay *= uniform(0.5, 1.5)
+            self.requests += 1
+        METRICS.observe("pace", delay)
+        if delay > 0:
+            if arg.debug:
+                print(f"\rDEBUG: Sleeping for {delay:.1f} secs...", file=sys.stderr)
+            time.sleep(delay)
+
+    def done(self, latency: float) -> None:
+        """A page came back fine after latency seconds"""
+        with self.lock:
+            if self.latency is None or self.usual_latency is None:
+                self.latency = self.usual_latency = latency
+            self.latency += 0.3 * (latency - self.latency)
+            self.usual_latency += 0.05 * (latency - self.usual_latency)
+            if self.latency > self.usual_latency * self.SLOW_FACTOR:
+                self.rate = max(self.min_rate, self.rate * 0.7)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.start_rate * 0.05)
+
+    def struggling(self) -> None:
+        """LSE failed a request or showed an alert, so back right off"""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            # And don't carry on from a full bucket
+            self.tokens = min(self.tokens, 0.0)
+
+    def backoff(self, attempt: int) -> float | None:
+        """
+        Seconds to wait before retry number attempt (from 1), or None if the
+        run's retry budget is spent
+        """
+        with self.lock:
+            if self.retries >= self.RETRY_BUDGET + self.requests // self.RETRY_EVERY:
+                return None
+            self.retries += 1
+        return uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2**attempt))
+
+
+class FetchError(Exception):
+    """Fetching a page failed, and has already been reported"""
+
+
+class FetchBackend:
+    """
+    Fetch pages over a pooled requests.Session, only starting the (slow, heavy)
+    Chrome driver when asked to, or when the plain session hits a bot wall
+    """
+
+    # Statuses LSE (or its CDN) hands to clients it thinks are bots, 429s
+    # and 503s just mean slow down, so fetch_page backs off from those
+    BOT_WALL_STATUS = (401, 403)
+    TIMEOUT = 30
+
+    def __init__(self, arg: argparse.Namespace) -> None:
+        self.arg = arg
+        self.session: requests.Session | None = None
+        self.driver: uc.Chrome | None = None
+        # There's only one Chrome, so workers take turns with it
+        self.lock = threading.Lock()
+        if arg.backend == "chrome":
+            self.driver = gen_driver(self.arg)
+        else:
+            self.session = gen_session(max(4, arg.jobs))
+
+    @property
+    def using_chrome(self) -> bool:
+        return self.session is None
+
+    def escalate(self) -> bool:
+        """Switch from the plain session to Chrome, returns False if we can't"""
+        with self.lock:
+            if self.arg.backend != "auto":
+                return False
+            if self.using_chrome:
+                # Another worker beat us to it, so have another go with Chrome
+                return True
+            print(
+                f"\r{Fore.LIGHTBLACK_EX}[!] Looks like a bot wall, switching to Chrome{Fore.RESET}",
+                file=sys.stderr,
+            )
+            if self.session is not None:
+                self.session.close()
+            self.session = None
+            METRICS.count("escalations")
+            with METRICS.time("retry"):
+                self.driver = gen_driver(self.arg)
+            return True
+
+    def get(self, url: str) -> str:
+        """Return the HTML source of the page at url"""
+        session = self.session
+        if session is not None:
+            return self._get_session(session, url)
+        return self._get_driver(url)
+
+    def _get_session(self, session: requests.Session, url: str) -> str:
+        response = session.get(url, timeout=self.TIMEOUT)
+        if response.status_code in self.BOT_WALL_STATUS and self.escalate():
+            return self._get_driver(url)
+        response.raise_for_status()
+        return response.text
+
+    def _get_driver(self, url: str) -> str:
+        with self.lock:
+            driver = self.driver
+            if driver is None:
+                # gen_driver has already said why
+                raise RuntimeError("Chrome isn't running")
+            try:
+                driver.get(url)
+            except InvalidSessionIdException:
+                # Chrome's gone, start another for the retry, and the rest
+                # of the crawl carries on from this page
+                METRICS.count("driver_restarts")
+                with METRICS.time("retry"):
+                    try:
+                        driver.quit()
+                    except Exception:
+                        pass
+                    self.driver = gen_driver(self.arg)
+                raise
+            if self.arg.lean:
+                return driver.execute_script(EXTRACT_SCRIPT)
+            root_elem = driver.find_element("xpath", "//*")
+            return root_elem.get_attribute("outerHTML")
+
+    def close(self) -> None:
+        if self.session is not None:
+            self.session.close()
+        if self.driver is not None:
+            self.driver.close()
+
+
+def transient(error: Exception) -> bool:
+    """Whether a failed fetch might work next time, rather than never"""
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else 0
+        return status == 429 or status >= 500
+    return isinstance(
+        error,
+        (requests.ConnectionError, requests.Timeout, TimeoutException, InvalidSessionIdException),
+    )
+
+
+def fetch_page(
+    backend: FetchBackend,
+    pacer: Pacer,
+    url: str,
+    page_num: int,
+    arg: argparse.Namespace,
+) -> tuple[str, bool]:
+    """
+    Fetch a single page of chat posts, retrying transient errors as the
+    pacer allows, returns the page's HTML and whether Chrome fetched it
+    """
+    attempt = 0
+    while True:
+        pacer.wait(arg)
+        if arg.debug:
+            print(f"[+] Getting {url}{page_num}", file=sys.stderr)
+        used_chrome = backend.using_chrome
+        try:
+            started = time.perf_counter()
+            page = backend.get(url + str(page_num))
+            METRICS.observe("fetch", time.perf_counter() - started)
+            if arg.archive:
+                archive_page(arg, page_num, page)
+        except Exception as get_error:
+            METRICS.count("fetch_errors")
+            print(f"{Fore.RED}[!] Error: {get_error}{Fore.RESET}", file=sys.stderr)
+            if not transient(get_error):
+                # eg. a 404 for a mistyped ticker, don't spend retries on it
+                raise FetchError(get_error) from get_error
+            pacer.struggling()
+            attempt += 1
+            delay = pacer.backoff(attempt)
+            if delay is None:
+                print(f"{Fore.RED}[!] Error: out of retries{Fore.RESET}", file=sys.stderr)
+                raise FetchError(get_error) from get_error
+            # Do as we're told, if LSE says how long to leave it
+            retry_after = getattr(getattr(get_error, "response", None), "headers", {}).get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            METRICS.count("retries")
+            print(
+                f"\r{Fore.LIGHTBLACK_EX}[!] Retrying page {page_num} in {delay:.1f} secs{Fore.RESET}",
+                file=sys.stderr,
+            )
+            with METRICS.time("retry"):
+                time.sleep(delay)
+            continue
+        pacer.done(time.perf_counter() - started)
+        return page, used_chrome
+
+
+@dataclass
+class ParsedPage:
+    """What's kept of a page once it's parsed, the soup itself is gone"""
+
+    page_num: int
+    posts: list[ChatPost]
+    alerted: bool
+    last: int  # See pager_last_page
+    final: bool
+    seconds: float = 0.0  # Spent parsing, in whichever process did it
+
+
+def parse_chat_page(
+    page_num: int, page: str, arg: argparse.Namespace, fetched: datetime | None = None
+) -> ParsedPage:
+    """
+    Parse a page of chat posts, run in the parse pool so may be in another
+    process (so no METRICS here). The soup is taken apart as soon as we've
+    got the posts out of it, rather than left for the garbage collector.
+    """
+    started = time.perf_counter()
+    page_soup = parse_page(page)
+    # Alerts on any page slow the pacer down, but on occasion LSE will
+    # enforce logins before chat can be viewed :< which only page 1 tells us
+    alerted = detect_alerts(page_soup, arg)
+    posts = [] if alerted and page_num == 1 else get_posts_from_page(page_soup, arg, fetched)
+    last, final = pager_last_page(page_soup, page_num)
+    page_soup.decompose()
+    return ParsedPage(page_num, posts, alerted, last, final, time.perf_counter() - started)
+
+
+def fetch_and_parse(
+    backend: FetchBackend,
+    pacer: Pacer,
+    parsers: Executor,
+    url: str,
+    page_num: int,
+    arg: argparse.Namespace,
+) -> tuple["Future[ParsedPage]", bool]:
+    """
+    Fetch a page and hand it straight to the parsers, so the fetch worker
+    can get on with the next page while this one is parsed
+    """
+    page, used_chrome = fetch_page(backend, pacer, url, page_num, arg)
+    return parsers.submit(parse_chat_page, page_num, page, arg), used_chrome
+
+
+def parsed_page(parsing: "Future[ParsedPage]", pacer: Pacer | None = None) -> ParsedPage:
+    """Wait for a page from the parsers, and count it in METRICS"""
+    parsed = parsing.result()
+    METRICS.observe("parse", parsed.seconds)
+    METRICS.count("pages")
+    METRICS.count("posts", len(parsed.posts))
+    if parsed.alerted:
+        METRICS.count("alerts")
+        if pacer is not None:
+            pacer.struggling()
+    return parsed
+
+
+@dataclass
+class PagePlan:
+    """
+    The pages a crawl needs, from start up to (not including) stop, narrowed
+    down as pages come in and show how many posts a page holds, and where
+    the chat ends
+    """
+
+    start: int
+    posts_max: int
+    pages_max: int
+    per_page: int = CHAT_PAGE_SIZE  # Until the first page says otherwise
+    last: int | None = None  # The chat's last page, once the pager shows it
+    learned: bool = False  # Whether the first page has come in yet
+
+    @property
+    def stop(self) -> int:
+        stop = min(self.pages_max, self.start + -(-self.posts_max // self.per_page))
+        if self.last is not None:
+            stop = min(stop, self.last + 1)
+        return stop
+
+    def learn(self, parsed: "ParsedPage") -> None:
+        if parsed.page_num == self.start and parsed.posts:
+            # In case LSE didn't give us the page size we asked for
+            self.per_page = len(parsed.posts)
+            self.learned = True
+        if parsed.final:
+            self.last = parsed.last
+
+
+def crawl_pages(
+    backend: FetchBackend,
+    pacer: Pacer,
+    parsers: Executor | None,
+    url: str,
+    arg: argparse.Namespace,
+    plan: PagePlan,
+) -> Generator[ParsedPage, None, None]:
+    """
+    Yield parsed pages strictly in page order, from a pipeline: up to
+    arg.jobs pages are fetched at once, each going to the parsers as soon
+    as it arrives, and one more page may be parsing or waiting for the
+    caller, which saves and prints meanwhile. Fetching
+    goes only as far as the plan says, as it stands after the pages yielded
+    so far, so until the first page is in it's the only one fetched. Stop
+    iterating early and the outstanding pages are dropped.
+    Only the first page of a crawl is blamed on a bot wall when it's empty,
+    later pages may just be past the end of the chat.
+    """
+    window = arg.jobs + 1
+    with ThreadPoolExecutor(max_workers=arg.jobs) as fetchers, (
+        nullcontext(parsers) if parsers is not None else ThreadPoolExecutor(max_workers=1)
+    ) as parsers:
+        pending: deque[Future] = deque()
+        page_num = plan.start
+        try:
+            while True:
+                while page_num < plan.stop and len(pending) < (window if plan.learned else 1):
+                    pending.append(
+                        fetchers.submit(
+                            fetch_and_parse, backend, pacer, parsers, url, page_num, arg
+                        )
+                    )
+                    page_num += 1
+                if not pending:
+                    return
+                parsing, used_chrome = pending.popleft().result()
+                parsed = parsed_page(parsing, pacer)
+                if (
+                    parsed.page_num == plan.start
+                    and not parsed.posts
+                    and not used_chrome
+                    and backend.escalate()
+                ):
+                    # A plain HTTP session may be served a bot wall instead
+                    # of the chat, so start again with Chrome before we
+                    # believe it, as the pages after it will be walls too
+                    for future in pending:
+                        future.cancel()
+                    pending.clear()
+                    page_num = plan.start
+                    continue
+                if parsed.page_num >= plan.stop:
+                    # Asked for before the plan knew we wouldn't need it
+                    return
+                yield parsed
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+@dataclass
+class Crawl:
+    """How far a dump of one target has got, for --watch to carry it on a few pages a turn"""
+
+    printed: int = 0  # Posts counted towards --posts_max so far
+    newest: ChatPost | None = None  # The checkpoint, once the crawl's complete
+
+
+@Halo(text="Dumping", spinner="dots", stream=sys.stderr)
 def dump_pages(
     url: str,
     arg: argparse.Namespace,
     conn: sqlite3.Connection | None,
+    backend: FetchBackend,
+    pacer: Pacer,
     PAGE_START: int,
     PAGES_MAX: int,
+    writer: "PostWriter | None" = None,
+    parsers: Executor | None = None,
+    crawl: Crawl | None = None,
+) -> int | None:
+    """
+    Dump pages PAGE_START up to PAGES_MAX of the chat at url, returns the
+    page to carry on from if PAGES_MAX cut it short, otherwise None. Pass
+    the crawl to carry on, so --posts_max counts the posts it's had already.
+    """
+    crawl = crawl or Crawl()
+    more: int | None = None
+    # Every page this crawl archives goes in one directory, see archive_page
+    arg.crawl_started = datetime.now()
+    checkpoint: str | None = None
+    if arg.save and isinstance(conn, sqlite3.Connection):
+        checkpoint = get_checkpoint(conn, target_name(arg))
+    # Whether the crawl got back to the last checkpoint or to the end of the
+    # chat, so everything older than its newest post is saved. A crawl cut
+    # short by --posts_max leaves a gap, which the next one has to fill in.
+    complete = False
+
+    plan = PagePlan(PAGE_START, arg.posts_max - crawl.printed, PAGES_MAX)
+    pages = crawl_pages(backend, pacer, parsers, url, arg, plan)
+    # Make sure prefetched pages are dropped before the next target starts
+    with closing(pages):
+        for parsed in pages:
+            page_num, soup_posts = parsed.page_num, parsed.posts
+            # LSE showed page 1 with an alert and no chat, or we're past the end
+            if len(soup_posts) == 0:
+                complete = page_num > 1
+                break
+            plan.learn(parsed)
+            if arg.debug and page_num == PAGE_START:
+                print(
+                    f"\rDEBUG: {plan.per_page} posts a page, "
+                    f"{plan.last or 'unknown'} pages, fetching up to page {plan.stop - 1}",
+                    file=sys.stderr,
+                )
+            if page_num == 1:
+                crawl.newest = soup_posts[0]
+
+            hashes = [p.hash() for p in soup_posts] if checkpoint is not None else []
+            if checkpoint in hashes:
+                # Everything older was saved by an earlier complete crawl
+                complete = True
+            if complete and arg.incremental and isinstance(conn, sqlite3.Connection):
+                if len(seen_in_db(conn, hashes)) == len(set(hashes)):
+                    if arg.debug:
+                        print(
+                            f"\rDEBUG: Page {page_num} already saved, stopping",
+                            file=sys.stderr,
+                        )
+                    break
+
+            # Print the posts from the page we just retrieved
+            crawl.printed = print_post(arg, soup_posts, crawl.printed, conn, writer)
+
+            if complete and arg.incremental:
+                if arg.debug:
+                    print(
+                        f"\rDEBUG: Reached last complete run's newest post on page {page_num}",
+                        file=sys.stderr,
+                    )
+                break
+
+            if crawl.printed >= arg.posts_max:
+                # We don't want any more chat posts than we have now
+                if arg.debug:
+                    print(
+                        f"\rDEBUG: posts_printed is >= {arg.posts_max}, exiting",
+                        file=sys.stderr,
+                    )
+                break
+
+            if plan.last is not None and page_num >= plan.last:
+                if arg.debug:
+                    print("\rDEBUG: Last chat page parsed", file=sys.stderr)
+                complete = True
+                break
+
+            if arg.debug:
+                print(f"\rDEBUG: Got {crawl.printed} posts", file=sys.stderr)
+        else:
+            # Unless there was nothing left below PAGES_MAX to fetch
+            if plan.stop == PAGES_MAX > PAGE_START:
+                more = PAGES_MAX
+
+    if complete and arg.save and crawl.newest is not None and isinstance(conn, sqlite3.Connection):
+        set_checkpoint(conn, target_name(arg), crawl.newest)
+    return more
+
+
+@Halo(text="Replaying", spinner="dots", stream=sys.stderr)
+def replay_pages(
+    arg: argparse.Namespace,
+    conn: sqlite3.Connection | None,
+    writer: "PostWriter | None" = None,
+    parsers: Executor | None = None,
 ) -> None:
-    # Define how to detect additional pages of chat messages
-    NEXT_PAGE = {"tag": "a", "class": "pager__link pager__link--next"}
-    # FIXME, last page detection is broken.
-    # This is the next button...can we extract the page number from it to check?
-    # Because when it's at the last page, it references the current page number
-    # <a href="https://www.lse.co.uk/ShareChat.html?ShareTicker=AFC&amp;share=AFC-Energy&amp;page=3" class="pager__link pager__link--next">
-    LAST_PAGE = {
-        "tag": "a",
-        "class": "pager__link pager__link--next pager__link--disabled",
-    }
-    PAGE_PAUSE_MAX = 5
+    """
+    Run every archived page for the user or ticker in arg back through the
+    usual parse, print and save steps, without touching the network
+    """
     posts_printed: int = 0
+    pages = replayed_pages(arg, parsers)
+    with closing(pages):
+        for parsed in pages:
+            if len(parsed.posts) == 0:
+                continue
+            posts_printed = print_post(arg, parsed.posts, posts_printed, conn, writer)
+            if posts_printed >= arg.posts_max:
+                break
 
-    driver = gen_driver()
 
-    for page_num in range(PAGE_START, PAGES_MAX):
-        random_pause = randrange(PAGE_PAUSE_MAX)
+def replayed_pages(arg: argparse.Namespace, parsers: Executor | None) -> Generator[ParsedPage, None, None]:
+    """
+    Yield the archived pages for the user or ticker in arg parsed, in order,
+    reading ahead and parsing up to arg.parse_jobs * 2 pages at once
+    """
+    window = arg.parse_jobs * 2
+    with nullcontext(parsers) if parsers is not None else ThreadPoolExecutor(max_workers=1) as parsers:
+        pending: deque[Future] = deque()
         try:
-            # firefox on MacOS
-            # FIXME, cookies = {"chat_page_size":"50"}
-            #headers = {
-            #    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)"
-            #    " AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.2 Safari/605.1.15"
-            #}
-            if arg.debug:
-                print(f"[+] Getting {url}{page_num}")
-
-            for _ in range(5):
+            for fetched, page_num, path in archived_pages(arg):
+                if page_num < arg.page:
+                    continue
+                if arg.debug:
+                    print(f"[+] Replaying {path}", file=sys.stderr)
                 try:
-                    driver.get(url + str(page_num))
-                    break
-                except InvalidSessionIdException as e:
-                    print(f"{Fore.RED}[!] Error: {e}{Fore.RESET}", file=sys.stderr)
-                    time.sleep(random_pause)
-                    driver.close()
-                    time.sleep(random_pause)
-                    driver = gen_driver()
-                    pass
-            root_elem = driver.find_element("xpath", "//*")
-            page = root_elem.get_attribute("outerHTML")
-        # except requests.exceptions.RequestException as get_error:
-        except Exception as get_error:
-            print(f"{Fore.RED}[!] Error: {get_error}{Fore.RESET}", file=sys.stderr)
-            driver.close()
-            sys.exit(1)
+                    with gzip.open(path, "rt", encoding="utf8") as archived:
+                        page = archived.read()
+                except (OSError, EOFError) as e:
+                    print(f"\r{Fore.RED}[!] Error reading {path}: {e}{Fore.RESET}", file=sys.stderr)
+                    continue
+                pending.append(parsers.submit(parse_chat_page, page_num, page, arg, fetched))
+                if len(pending) >= window:
+                    yield parsed_page(pending.popleft())
+            while pending:
+                yield parsed_page(pending.popleft())
+        finally:
+            for future in pending:
+                future.cancel()
 
-        page_soup = BeautifulSoup(page, "html.parser")
-        BeautifulSoup()
 
-        # On occasion, LSE will enforce logins before chat can be viewed :<
-        if page_num == 1:
-            if detect_alerts(page_soup, arg):
-                break
+# How many pages the writer may fall behind the crawl
+WRITE_DEPTH = 8
 
-        soup_posts = get_posts_from_page(page_soup, arg)
-        if len(soup_posts) == 0:
-            break
 
-        # Print the posts from the page we just retrieved
-        posts_printed = print_post(arg, soup_posts, posts_printed, conn)
+# One line of JSON per post, leaving non-ASCII text as it is
+NDJSON_ENCODE = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
 
-        if posts_printed >= arg.posts_max:
-            # We don't want any more chat posts than we have now
-            if arg.debug:
-                print(
-                    f"\rDEBUG: posts_printed is >= {arg.posts_max}, exiting",
-                    file=sys.stderr,
-                )
-            break
 
-        if page_soup.find(NEXT_PAGE["tag"], class_=NEXT_PAGE["class"]) is None:
-            if arg.debug:
-                print(
-                    f"\rDEBUG: Page {page_num}, and no next page found?",
-                    file=sys.stderr,
-                )
-            break
-        if page_soup.find(LAST_PAGE["tag"], class_=LAST_PAGE["class"]) is not None:
-            # This is broken now, no last page tag in the source
-            if arg.debug:
-                print("\rDEBUG: Last chat page parsed", file=sys.stderr)
-            break
+class PostWriter:
+    """
+    Writes posts to stdout a page at a time, as coloured text, NDJSON or CSV.
+    Each page is formatted in one go and written with a single write, and
+    only the text format has any colour codes in it.
 
-        if arg.debug:
-            print(f"\rDEBUG: Got {posts_printed} posts,"
-                  f"sleeping for {random_pause} secs...", file=sys.stderr)
+    Given a depth, pages are written from a thread of their own, up to depth
+    pages behind, so a slow reader on stdout doesn't hold up the crawl. Call
+    close() to wait for the rest to be written.
+    """
+
+    FORMATS = ["text", "ndjson", "csv"]
+    FIELDS = ["hash", "username", "ticker", "atprice", "opinion", "date", "title", "text"]
 
-        time.sleep(random_pause)
+    def __init__(self, format: str = "text", stream: TextIO | None = None, depth: int = 0) -> None:
+        self.format = format
+        self.stream = stream or sys.stdout
+        self.header = format == "csv"
+        # Posts written so far, in --save mode only ones we hadn't seen
+        self.written = 0
+        self.pages: Queue[list[ChatPost] | None] | None = None
+        self.thread: threading.Thread | None = None
+        # Why the writing thread stopped writing, for the next write to raise
+        self.error: BaseException | None = None
+        if depth:
+            self.pages = Queue(maxsize=depth)
+            self.thread = threading.Thread(target=self._drain, args=(self.pages,), daemon=True)
+            self.thread.start()
 
-    driver.close()
+    @staticmethod
+    def fields(post: ChatPost) -> tuple:
+        return (
+            post.hash(),
+            post.username,
+            post.ticker,
+            post.atprice,
+            post.opinion,
+            post.date,
+            post.title,
+            post.text,
+        )
+
+    def write(self, posts: list[ChatPost]) -> None:
+        if self.error is not None:
+            raise self.error
+        self.written += len(posts)
+        METRICS.count("posts_emitted", len(posts))
+        if self.pages is None:
+            self._write(posts)
+        else:
+            self.pages.put(posts)
+
+    def close(self) -> None:
+        """Wait for any pages still queued to be written"""
+        if self.thread is not None and self.pages is not None:
+            self.pages.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _drain(self, pages: Queue[list[ChatPost] | None]) -> None:
+        while (posts := pages.get()) is not None:
+            if self.error is not None:
+                # Keep taking pages, so write() never blocks on a full queue
+                continue
+            try:
+                self._write(posts)
+            except BaseException as e:
+                self.error = e
+
+    def _write(self, posts: list[ChatPost]) -> None:
+        started = time.perf_counter()
+        if self.format == "text":
+            page = "".join("\r" + str(post) + "\n" for post in posts)
+        elif self.format == "ndjson":
+            page = "".join(
+                NDJSON_ENCODE(dict(zip(self.FIELDS, self.fields(post)))) + "\n"
+                for post in posts
+            )
+        else:
+            buffer = io.StringIO()
+            rows = csv.writer(buffer)
+            if self.header:
+                rows.writerow(self.FIELDS)
+                self.header = False
+            rows.writerows(map(self.fields, posts))
+            page = buffer.getvalue()
+        if page:
+            self.stream.write(page)
+            self.stream.flush()
+        METRICS.observe("emit", time.perf_counter() - started)
 
 
 def print_post(
@@ -441,6 +1510,7 @@ def print_post(
     soup_posts: list,
     posts_printed: int = 0,
     conn: None | sqlite3.Connection = None,
+    writer: PostWriter | None = None,
 ) -> int:
     """
     Print an entire page of soup_posts, up to the args.posts_max limit
@@ -458,55 +1528,278 @@ def print_post(
                 break
 
     else:
-        for chatpost in soup_posts:
+        writer = writer or PostWriter()
+        page_posts: list[ChatPost] = []
+        db = conn if arg.save and isinstance(conn, sqlite3.Connection) else None
+        if db is not None:
+            # Look up the whole page at once, rather than a query per post
+            hashes = [p.hash() for p in soup_posts[: arg.posts_max - posts_printed]]
+            with METRICS.time("dedup"):
+                seen = seen_in_db(db, hashes)
+            new_rows: list[tuple] = []
+        for i, chatpost in enumerate(soup_posts):
             if posts_printed < arg.posts_max:
-                if arg.save:
-                    if isinstance(conn, sqlite3.Connection):
-                        # Insert a hash of the post into the database
-                        if exists_in_db(conn, chatpost.hash()):
-                            if not SEEN_SOME:
-                                print(
-                                    f"\r{Fore.LIGHTBLACK_EX}[!] Not showing some posts {posts_printed} already saved{Fore.RESET}",
-                                    file=sys.stderr,
-                                )
-                            posts_printed += 1
-                            SEEN_SOME = True
-                        else:
-                            add_to_db(conn, chatpost.hash(), chatpost)
-                            print("\r" + str(chatpost))
-                            posts_printed += 1
-                            SEEN_SOME = False
-                else:
-                    print("\r" + str(chatpost))
+                if db is not None:
+                    if hashes[i] in seen:
+                        if not SEEN_SOME:
+                            print(
+                                f"\r{Fore.LIGHTBLACK_EX}[!] Not showing some posts {posts_printed} already saved{Fore.RESET}",
+                                file=sys.stderr,
+                            )
+                        posts_printed += 1
+                        SEEN_SOME = True
+                    else:
+                        # Take the row before printing, __str__ rewrites the opinion
+                        seen.add(hashes[i])
+                        new_rows.append(post_row(hashes[i], chatpost))
+                        page_posts.append(chatpost)
+                        posts_printed += 1
+                        SEEN_SOME = False
+                elif not arg.save:
+                    page_posts.append(chatpost)
                     posts_printed += 1
             else:
                 break
+        if db is not None and new_rows:
+            with METRICS.time("insert"):
+                add_rows_to_db(db, new_rows)
+        writer.write(page_posts)
 
     # We like to keep track of how many posts we've printed so far,
     # in order we dont show more than the user supplied posts_max arg
     return posts_printed
 
 
+def recent_post_rate(conn: sqlite3.Connection, arg: argparse.Namespace) -> float:
+    """Posts per second saved for the user or ticker in arg over the last day"""
+    DAY = 86400
+    # Post times are London wall clock, see posts_schema
+    now = to_epoch(str(datetime.now(ZoneInfo("Europe/London")).replace(tzinfo=None, microsecond=0)))
+    if now is None:
+        return 0.0
+    column, value = ("username", arg.user) if arg.user else ("ticker", arg.ticker)
+    try:
+        count = conn.execute(
+            f"SELECT COUNT(*) FROM posts WHERE {column} = ? AND epoch > ?", (value, now - DAY)
+        ).fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"\r[!] Error counting recent posts in database : {e}", file=sys.stderr)
+        return 0.0
+    return count / DAY
+
+
+@dataclass
+class Watched:
+    """A user or ticker being watched, and how often it gets new posts"""
+
+    arg: argparse.Namespace
+    url: str
+    rate: float = 0.0  # New posts per second, a moving average over polls
+    interval: float = 0.0
+    polled: float | None = None
+    # A poll with more than WATCH_PAGES pages of new posts carries on from
+    # this page next turn, having counted new posts since it started
+    backlog: int | None = None
+    crawl: Crawl = field(default_factory=Crawl)
+    started: float = 0.0
+    new: int = 0
+
+
+def watch_targets(
+    arg: argparse.Namespace,
+    conn: sqlite3.Connection,
+    backend: FetchBackend,
+    pacer: Pacer,
+    writer: PostWriter,
+    PAGES_MAX: int,
+    parsers: Executor | None = None,
+) -> None:
+    """
+    Poll every target for new posts until interrupted, each as often as it
+    needs to catch about WATCH_POSTS new posts a time, within WATCH_MIN and
+    WATCH_MAX seconds. Every poll is an --incremental dump, so it reads on
+    past page 1 only when page 1 is all new, and WATCH_PAGES pages at most
+    before letting other targets have a turn, so catching up on a new or
+    busy target doesn't hold up the rest. --posts_max caps each poll, over
+    all its turns.
+    """
+    WATCH_MIN: float = 60
+    WATCH_MAX: float = 3600
+    WATCH_POSTS: int = 5
+    WATCH_PAGES: int = 10
+    # How much the latest poll counts towards a target's post rate
+    RATE_WEIGHT: float = 0.5
+
+    watched = []
+    for user, ticker in arg.targets:
+        target_arg = argparse.Namespace(**vars(arg))
+        target_arg.user, target_arg.ticker = user, ticker
+        target_arg.incremental = True
+        watched.append(Watched(target_arg, target_url(target_arg)))
+    # Polls due as (when, turn, target), the turn keeping ties first come first served
+    turns = itertools.count(len(watched))
+    due = [(0.0, n, n) for n in range(len(watched))]
+
+    try:
+        while True:
+            when, _, n = heapq.heappop(due)
+            time.sleep(max(0.0, when - time.monotonic()))
+            target = watched[n]
+            written = writer.written
+            started = time.monotonic()
+            page = target.backlog or 1
+            if page == 1:
+                target.started, target.new, target.crawl = started, 0, Crawl()
+            try:
+                target.backlog = dump_pages(
+                    target.url,
+                    target.arg,
+                    conn,
+                    backend,
+                    pacer,
+                    page,
+                    min(PAGES_MAX, page + WATCH_PAGES),
+                    writer,
+                    parsers,
+                    target.crawl,
+                )
+            except FetchError:
+                # Try again later, backing off while it keeps failing
+                target.interval = min(WATCH_MAX, max(WATCH_MIN, target.interval * 2))
+                heapq.heappush(due, (started + target.interval, next(turns), n))
+                continue
+            finally:
+                target.new += writer.written - written
+
+            if target.backlog is not None:
+                # Carry on once every target due by now has had its turn
+                heapq.heappush(due, (time.monotonic(), next(turns), n))
+                continue
+            if target.polled is None:
+                # The first poll catches up on whatever we missed, so start
+                # from how busy it's been lately instead
+                target.rate = recent_post_rate(conn, target.arg)
+            else:
+                latest = target.new / (target.started - target.polled)
+                target.rate = RATE_WEIGHT * latest + (1 - RATE_WEIGHT) * target.rate
+            target.polled = target.started
+            target.interval = WATCH_MAX if target.rate <= 0 else min(WATCH_MAX, max(WATCH_MIN, WATCH_POSTS / target.rate))
+            if arg.debug:
+                print(
+                    f"\rDEBUG: {target_name(target.arg)} {target.new} new, "
+                    f"{target.rate * 3600:.1f} posts/hour, next poll in {target.interval:.0f}s",
+                    file=sys.stderr,
+                )
+            heapq.heappush(due, (target.started + target.interval, next(turns), n))
+            write_metrics(arg)
+    except KeyboardInterrupt:
+        print(f"\r{Fore.LIGHTBLACK_EX}[!] Stopped watching{Fore.RESET}", file=sys.stderr)
+
+
+def write_metrics(arg: argparse.Namespace) -> None:
+    """Write the crawl metrics to --metrics-file, if asked to, carrying on if we can't"""
+    if arg.metrics_file:
+        try:
+            METRICS.write_json(arg.metrics_file)
+        except OSError as e:
+            print(f"\r{Fore.RED}[!] Error writing {arg.metrics_file}: {e}{Fore.RESET}", file=sys.stderr)
+
+
+def report_metrics(arg: argparse.Namespace) -> None:
+    """Write out the crawl metrics as asked for in arg"""
+    write_metrics(arg)
+    if arg.stats:
+        print("\r" + METRICS.summary(), file=sys.stderr)
+
+
 def main() -> None:
     # Be nice to the LSE server
     PAGES_MAX: int = 4096
     PAGE_START: int = 1
+    PAGE_PAUSE_MAX: int = 5
     # Parse the command arguments
     arg = get_arguments()
-    url: str = ""
-    if arg.user:
-        url = "https://www.lse.co.uk/profiles/" + arg.user + "/?page="
-    if arg.ticker:
-        url = "https://www.lse.co.uk/ShareChat.asp?ShareTicker=" + arg.ticker + "&page="
     if arg.page:
         PAGE_START = arg.page
+    conn: sqlite3.Connection | None = None
     if arg.save:
         # Create and/or open the seen posts database
-        conn = create_db("posts.sqlite3")
-        dump_pages(url, arg, conn, PAGE_START, PAGES_MAX)
-        conn.close()
-    else:
-        dump_pages(url, arg, None, PAGE_START, PAGES_MAX)
+        conn = create_db("posts.sqlite3", arg.fts)
+
+    # One writer for every target, so CSV gets one header, writing in the
+    # background unless we're printing posts straight out with --debug
+    writer = PostWriter(arg.format, depth=0 if arg.debug else WRITE_DEPTH)
+    # And one pool of parsers, in processes of their own if there's enough
+    # parsing to go round. Those are started lazily, from a fetch thread while
+    # others run, so from a fork server rather than by forking us
+    parsers: Executor = (
+        ProcessPoolExecutor(
+            max_workers=arg.parse_jobs, mp_context=multiprocessing.get_context("forkserver")
+        )
+        if arg.parse_jobs > 1
+        else ThreadPoolExecutor(max_workers=1)
+    )
+    if arg.prometheus:
+        try:
+            METRICS.serve(arg.prometheus)
+        except OSError as e:
+            print(f"\r{Fore.RED}[!] Error serving metrics on port {arg.prometheus}: {e}{Fore.RESET}", file=sys.stderr)
+            sys.exit(1)
+
+    if arg.replay:
+        try:
+            for user, ticker in arg.targets:
+                target_arg = argparse.Namespace(**vars(arg))
+                target_arg.user, target_arg.ticker = user, ticker
+                replay_pages(target_arg, conn, writer, parsers)
+        finally:
+            parsers.shutdown(cancel_futures=True)
+            writer.close()
+            if conn is not None:
+                conn.close()
+            report_metrics(arg)
+        return
+
+    # Every target shares one fetch backend (and so at most one Chrome),
+    # one pacer and one database connection, each with its own page cursor
+    backend = FetchBackend(arg)
+    pacer = Pacer(PAGE_PAUSE_MAX)
+    try:
+        # get_arguments won't let --watch run without --save
+        if arg.watch and conn is not None:
+            watch_targets(arg, conn, backend, pacer, writer, PAGES_MAX, parsers)
+            return
+        failed = []
+        for user, ticker in arg.targets:
+            target_arg = argparse.Namespace(**vars(arg))
+            target_arg.user, target_arg.ticker = user, ticker
+            if arg.debug:
+                print(f"\rDEBUG: Dumping {user or ticker}", file=sys.stderr)
+            try:
+                dump_pages(
+                    target_url(target_arg),
+                    target_arg,
+                    conn,
+                    backend,
+                    pacer,
+                    PAGE_START,
+                    PAGES_MAX,
+                    writer,
+                    parsers,
+                )
+            except FetchError:
+                # What we got so far is saved, so move on to the next one
+                failed.append(target_name(target_arg))
+        if failed:
+            print(f"\r{Fore.RED}[!] Error: gave up on {', '.join(failed)}{Fore.RESET}", file=sys.stderr)
+            sys.exit(1)
+    finally:
+        parsers.shutdown(cancel_futures=True)
+        writer.close()
+        backend.close()
+        if conn is not None:
+            conn.close()
+        report_metrics(arg)
 
 
 if __name__ == "__main__":
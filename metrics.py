@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Counters and latency histograms for the stages of a crawl, shared by every
+worker thread, and ways to get them out: a summary for the end of a run, a
+JSON file, and the Prometheus text format over HTTP
+"""
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+# Upper bounds of the latency buckets, in seconds, as Prometheus expects
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """How many observations fell at or under each bucket bound, and their sum"""
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """The bucket bound the q'th quantile falls under, or the max past them"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """A thread safe registry of named counters, and of histograms per stage"""
+
+    def __init__(self, prefix: str = "dumplse") -> None:
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters: dict[str, int] = {}
+        self.stages: dict[str, Histogram] = {}
+        self.started = time.monotonic()
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].observe(seconds)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Time the body of a with statement as one run of stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        """All the metrics as plain data, with rates over the run so far"""
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            counters = dict(self.counters)
+            stages = {
+                stage: {
+                    "count": h.count,
+                    "seconds": h.sum,
+                    "mean": h.sum / h.count if h.count else 0.0,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                    "max": h.max,
+                    "buckets": dict(zip([*map(str, BUCKETS), "+Inf"], h.buckets)),
+                }
+                for stage, h in self.stages.items()
+            }
+        rates = {f"{name}_per_sec": n / elapsed for name, n in counters.items() if elapsed > 0}
+        return {"elapsed": elapsed, "counters": counters, "rates": rates, "stages": stages}
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w", encoding="utf8") as metrics_file:
+            json.dump(self.snapshot(), metrics_file, indent=2)
+            metrics_file.write("\n")
+
+    def summary(self) -> str:
+        """A table of the stages and counters, for the end of a run"""
+        snap = self.snapshot()
+        lines = [f"{'stage':<10}{'count':>8}{'total s':>10}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        for stage, s in sorted(snap["stages"].items(), key=lambda x: -x[1]["seconds"]):
+            lines.append(
+                f"{stage:<10}{s['count']:>8}{s['seconds']:>10.2f}{s['mean'] * 1000:>10.1f}"
+                f"{s['p95'] * 1000:>10.1f}{s['max'] * 1000:>10.1f}"
+            )
+        lines.append("")
+        for name, n in sorted(snap["counters"].items()):
+            lines.append(f"{name:<20}{n:>10}  {snap['rates'].get(name + '_per_sec', 0.0):>8.2f}/s")
+        lines.append(f"{'elapsed':<20}{snap['elapsed']:>10.1f}s")
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format"""
+        with self.lock:
+            counters = dict(self.counters)
+            stages = {stage: (list(h.buckets), h.sum, h.count) for stage, h in self.stages.items()}
+        name = f"{self.prefix}_stage_seconds"
+        lines = [
+            f"# HELP {name} Time spent in each stage of the crawl",
+            f"# TYPE {name} histogram",
+        ]
+        for stage, (buckets, total, count) in sorted(stages.items()):
+            seen = 0
+            for bound, n in zip([*map(str, BUCKETS), "+Inf"], buckets):
+                seen += n
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {seen}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+        for counter, n in sorted(counters.items()):
+            lines.append(f"# TYPE {self.prefix}_{counter}_total counter")
+            lines.append(f"{self.prefix}_{counter}_total {n}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve /metrics in the Prometheus format from a background thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -1,60 +1,168 @@
 #!/usr/bin/env python3
-r"""
-A tool to normalise times to the nearest multiple (eg. 60minutes), so a distribution can be viewed more readily
+"""
+A tool to normalise post times to the nearest multiple (eg. 60minutes), and
+count them up per user, ticker or weekday, so a distribution can be viewed
+more readily. Reads posts.sqlite3 directly, binning in SQLite as it goes, so
+it never holds more than the counts however many posts there are.
 
 eg.
-    $ sqlite3 posts.sqlite3 'select username,date from posts where ticker is "AFC"' | sed -E 's/\ ?\|.*\ / /;s/://g;s/00$//' > usertimes.out
-    $ ./normalise.py usertimes.out 60 | grep -i anneowl | distribution --color --height=50 | sort -n +1
-             Key|Ct (Pct)   Histogram
-    AnneOwl 0000| 3 (0.87%) ------
-    AnneOwl 0100| 1 (0.29%) --
-    AnneOwl 0300| 1 (0.29%) --
-    AnneOwl 0400| 1 (0.29%) --
-    AnneOwl 0600| 1 (0.29%) --
-    AnneOwl 0700| 4 (1.16%) -------
-    AnneOwl 0800|20 (5.81%) -----------------------------------
-    AnneOwl 0900|30 (8.72%) ----------------------------------------------------
-    AnneOwl 1000|27 (7.85%) -----------------------------------------------
-    AnneOwl 1100|26 (7.56%) ---------------------------------------------
-    AnneOwl 1200|18 (5.23%) -------------------------------
-    AnneOwl 1300|26 (7.56%) ---------------------------------------------
-    AnneOwl 1400|23 (6.69%) ----------------------------------------
-    AnneOwl 1500|30 (8.72%) ----------------------------------------------------
-    AnneOwl 1600|22 (6.40%) --------------------------------------
-    AnneOwl 1700|18 (5.23%) -------------------------------
-    AnneOwl 1800|32 (9.30%) --------------------------------------------------------
-    AnneOwl 1900|18 (5.23%) -------------------------------
-    AnneOwl 2000|12 (3.49%) ---------------------
-    AnneOwl 2100|14 (4.07%) -------------------------
-    AnneOwl 2200| 9 (2.62%) ----------------
-    AnneOwl 2300| 8 (2.33%) --------------
+    $ ./normalise.py posts.sqlite3 -m 60 -t AFC -u AnneOwl --render
+    AnneOwl  344 posts
+    0000|  3 (0.87%) ------
+    0100|  1 (0.29%) --
+    0300|  1 (0.29%) --
+    ...
+    0800| 20 (5.81%) -----------------------------------
+    0900| 30 (8.72%) ----------------------------------------------------
+    ...
+    $ ./normalise.py posts.sqlite3 --by weekday --since 2024-01-01
+    Mon 0000 112
+    Mon 0100 48
+    ...
 """
-import sys
+import argparse
 import os
+import shutil
+import sqlite3
+import sys
+from datetime import datetime
+
+from posts_schema import day, day_epochs, ensure_schema
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# What each --by counts posts per, 1970-01-01 (epoch day 0) was a Thursday
+GROUP_KEYS = {
+    "user": "username",
+    "ticker": "ticker",
+    "weekday": "(epoch / 86400 + 3) % 7",
+    "all": "''",
+}
+
+
+def get_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Histograms of when posts are made")
+    parser.add_argument("db", nargs="?", default="posts.sqlite3", help="Posts database (default: posts.sqlite3)")
+    parser.add_argument("--minutes", "-m", type=int, default=60, help="Round times to this many minutes (default: 60)")
+    parser.add_argument("--by", "-b", choices=GROUP_KEYS, default="user", help="Count per user, ticker, weekday or all posts")
+    parser.add_argument("--ticker", "-t", help="Only posts on this ticker", type=str)
+    parser.add_argument("--user", "-u", help="Only posts by this user", type=str)
+    parser.add_argument("--since", help="Only posts on or after YYYY-MM-DD", type=day)
+    parser.add_argument("--until", help="Only posts on or before YYYY-MM-DD", type=day)
+    parser.add_argument("--top", "-n", type=int, help="Only the users/tickers with the most posts")
+    parser.add_argument("--render", "-r", help="Draw each histogram, rather than print counts", action="store_true")
+    _arg = parser.parse_args()
+    if _arg.minutes < 1 or 60 % _arg.minutes:
+        # pylint: disable=raising-bad-type
+        raise parser.error("minutes must divide an hour, eg. 5, 15, 30 or 60")
+    return _arg
 
-filename = sys.argv[1]
-rounding_factor = int(sys.argv[2])
 
+def time_bin(minutes: int) -> str:
+    """
+    SQL for the minute of the day of a post, its minutes rounded to the
+    nearest multiple, halves to even as Python's round() does
+    """
+    minute = "(epoch / 60 % 60)"
+    quotient, remainder = f"({minute} / {minutes})", f"({minute} % {minutes})"
+    round_up = (
+        f"(2 * {remainder} > {minutes} OR (2 * {remainder} = {minutes} AND {quotient} % 2 = 1))"
+    )
+    return f"((epoch / 3600 % 24) * 60 + ({quotient} + {round_up}) * {minutes}) % 1440"
 
-def round_to_multiple(number: int, multiple: int) -> int:
-    return round(number / multiple) * multiple
+
+def histograms(
+    conn: sqlite3.Connection,
+    minutes: int = 60,
+    by: str = "user",
+    ticker: str | None = None,
+    user: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    top: int | None = None,
+) -> dict[str, dict[int, int]]:
+    """
+    Returns the count of posts in each minute of the day bin, for each user,
+    ticker or weekday, in order of key and bin
+    """
+    where: list[str] = ["epoch IS NOT NULL"]
+    params: list[object] = []
+    if ticker:
+        where.append("ticker = ?")
+        params.append(ticker.upper())
+    if user:
+        where.append("username = ?")
+        params.append(user)
+    start, end = day_epochs(since, until)
+    if start is not None:
+        where.append("epoch >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("epoch < ?")
+        params.append(end)
+    key = GROUP_KEYS[by]
+    filters = " AND ".join(where)
+
+    if top and by in ("user", "ticker"):
+        # Just the busiest, chosen before we bin anything
+        where.append(
+            f"{key} IN (SELECT {key} FROM posts WHERE {filters} GROUP BY {key} ORDER BY COUNT(*) DESC LIMIT ?)"
+        )
+        params += params + [top]
+
+    rows = conn.execute(
+        f"""SELECT {key}, {time_bin(minutes)} AS bin, COUNT(*) FROM posts
+        WHERE {" AND ".join(where)} GROUP BY 1, 2 ORDER BY 1, 2""",
+        params,
+    )
+    counts: dict[str, dict[int, int]] = {}
+    for name, minute_bin, count in rows:
+        name = WEEKDAYS[name] if by == "weekday" else str(name)
+        counts.setdefault(name, {})[minute_bin] = count
+    return counts
+
+
+def render(name: str, bins: dict[int, int], width: int) -> str:
+    """Draw a histogram as bars of dashes, scaled to fit width"""
+    total = sum(bins.values())
+    most = max(bins.values())
+    count_width = len(str(most))
+    bar_width = max(10, width - count_width - 16)
+    lines = [f"{name}  {total} posts" if name else f"{total} posts"]
+    for minute_bin, count in bins.items():
+        bar = "-" * max(1, round(count / most * bar_width))
+        lines.append(
+            f"{minute_bin // 60:02d}{minute_bin % 60:02d}|{count:{count_width}} ({count / total:.2%}) {bar}"
+        )
+    return "\n".join(lines)
 
 
 def main() -> None:
+    arg = get_arguments()
+    if not os.path.exists(arg.db):
+        print(f"{arg.db}: no such database", file=sys.stderr)
+        sys.exit(1)
+    conn = sqlite3.connect(arg.db)
+    try:
+        # The bins come from the epoch column, which version 1 databases lack
+        ensure_schema(conn)
+        counts = histograms(conn, arg.minutes, arg.by, arg.ticker, arg.user, arg.since, arg.until, arg.top)
+    except sqlite3.Error as e:
+        print(f"{arg.db}: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    if arg.by == "weekday":
+        counts = {name: counts[name] for name in WEEKDAYS if name in counts}
     try:
-        with open(filename, "r") as data:
-            for line in data:
-                user, time = line.rstrip().split(" ", 2)
-                hour, minute = int(time[:2]), int(time[2:])
-                rounded_hour = hour
-                rounded_min = round_to_multiple(minute, rounding_factor)
-                if rounded_min == 60:
-                    rounded_min = 0
-                    if rounded_hour == 23:
-                        rounded_hour = 0
-                    else:
-                        rounded_hour += 1
-                print(f"{user} {rounded_hour:02d}{rounded_min:02d}")
+        if arg.render:
+            width = shutil.get_terminal_size().columns
+            print("\n\n".join(render(name, bins, width) for name, bins in counts.items()))
+        else:
+            for name, bins in counts.items():
+                for minute_bin, count in bins.items():
+                    print(f"{name} {minute_bin // 60:02d}{minute_bin % 60:02d} {count}".lstrip())
         sys.stdout.flush()
     except BrokenPipeError:
         # Python flushes standard streams on exit; redirect remaining output
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+The schema of the posts.sqlite3 database shared by dumplse.py and
+sentiment_analysis.py, and an in-place migration for older databases
+
+eg.
+    $ ./posts_schema.py posts.sqlite3
+    posts.sqlite3: schema version 1 -> 2
+    $ ./posts_schema.py --fts posts.sqlite3
+    posts.sqlite3: schema version 2 -> 2, full text index built
+"""
+import argparse
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+SCHEMA_VERSION = 2
+
+# Version 1 was just the posts table, with the date and price as scraped.
+# Version 2 adds typed copies of those, and indexes to look posts up by them:
+#   epoch  the post's LSE (London) wall clock time as seconds since 1970,
+#          taken as if it were UTC, so SQLite's 'unixepoch' gives it back as is
+#   pence  the share price in pence when posted, eg. 1686.6 for "1,686.60"
+POSTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS posts
+    (hash TEXT PRIMARY KEY,
+    username TEXT,
+    ticker TEXT,
+    atprice TEXT,
+    opinion TEXT,
+    date TEXT,
+    title TEXT,
+    text TEXT,
+    epoch INTEGER,
+    pence REAL)
+"""
+POSTS_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS posts_ticker_epoch ON posts (ticker, epoch)",
+    "CREATE INDEX IF NOT EXISTS posts_username_epoch ON posts (username, epoch)",
+]
+
+# The optional full text index over posts' titles and text. It holds no copy
+# of the posts, just the index, and the triggers keep it in step with every
+# insert, update and delete on posts, whoever makes them.
+FTS_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts
+    USING fts5(title, text, content='posts', content_rowid='rowid')
+"""
+FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts (rowid, title, text) VALUES (new.rowid, new.title, new.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts (posts_fts, rowid, title, text) VALUES ('delete', old.rowid, old.title, old.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF title, text ON posts BEGIN
+        INSERT INTO posts_fts (posts_fts, rowid, title, text) VALUES ('delete', old.rowid, old.title, old.text);
+        INSERT INTO posts_fts (rowid, title, text) VALUES (new.rowid, new.title, new.text);
+    END""",
+]
+
+
+def to_epoch(date: str | None) -> int | None:
+    """Returns the epoch for a post's date, or None if it never got parsed"""
+    if date is None:
+        return None
+    try:
+        when = datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+    return wall_epoch(when)
+
+
+def wall_epoch(when: datetime) -> int:
+    """Returns the epoch for an LSE wall clock time, as the posts table has it"""
+    return int(when.replace(tzinfo=timezone.utc).timestamp())
+
+
+def from_epoch(epoch: int) -> datetime:
+    """Returns the LSE wall clock time for an epoch from the posts table"""
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+
+def day(text: str) -> datetime:
+    """argparse type for a YYYY-MM-DD date, eg. for --since and --until"""
+    try:
+        return datetime.strptime(text, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' is not a YYYY-MM-DD date") from None
+
+
+def day_epochs(since: datetime | None, until: datetime | None) -> tuple[int | None, int | None]:
+    """
+    Returns the (start, end) epochs of posts made on or after the since day
+    and on or before the until day, for epoch >= start AND epoch < end,
+    either None if there's no such day
+    """
+    start = wall_epoch(since) if since else None
+    # Up to midnight after it, so the until day is taken in whole
+    end = wall_epoch(until + timedelta(days=1)) if until else None
+    return start, end
+
+
+def to_pence(price: str | float | None) -> float | None:
+    """Returns a post's price as a number of pence, or None if it isn't one"""
+    if price is None:
+        return None
+    try:
+        return float(str(price).replace(",", "").rstrip("p").strip())
+    except ValueError:
+        return None
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """Returns the schema version of the database, 0 if it's empty"""
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if "schema_version" in tables:
+        return conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+    return 1 if "posts" in tables else 0
+
+
+def ensure_schema(conn: sqlite3.Connection) -> int:
+    """
+    Create the posts table, or migrate it in place up to SCHEMA_VERSION,
+    returns the version we started from
+    """
+    version = schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(
+            f"database schema version {version} is newer than {SCHEMA_VERSION}"
+        )
+    if version == SCHEMA_VERSION:
+        return version
+
+    if conn.in_transaction:
+        conn.commit()
+    # sqlite3 commits before DDL unless we've begun a transaction ourselves,
+    # so begin one, taking the write lock before looking again in case
+    # another process has migrated it meanwhile
+    conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        version = schema_version(conn)
+        if version == SCHEMA_VERSION:
+            return version
+        if version == 0:
+            conn.execute(POSTS_TABLE)
+        if version == 1:
+            # Older versions of this could leave the columns behind
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(posts)")}
+            if "epoch" not in columns:
+                conn.execute("ALTER TABLE posts ADD COLUMN epoch INTEGER")
+            if "pence" not in columns:
+                conn.execute("ALTER TABLE posts ADD COLUMN pence REAL")
+            conn.create_function("to_epoch", 1, to_epoch, deterministic=True)
+            conn.create_function("to_pence", 1, to_pence, deterministic=True)
+            conn.execute("UPDATE posts SET epoch = to_epoch(date), pence = to_pence(atprice)")
+        for index in POSTS_INDEXES:
+            conn.execute(index)
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        conn.execute("DELETE FROM schema_version")
+        conn.execute("INSERT INTO schema_version (version) VALUES (?)", (SCHEMA_VERSION,))
+    return version
+
+
+def has_fts(conn: sqlite3.Connection) -> bool:
+    """Returns whether the database has the full text index"""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'"
+    ).fetchone() is not None
+
+
+def ensure_fts(conn: sqlite3.Connection) -> bool:
+    """
+    Create the full text index and its triggers, indexing every post already
+    saved, returns whether it had to be built. Raises sqlite3.OperationalError
+    if this SQLite was built without FTS5.
+    """
+    if has_fts(conn):
+        return False
+    with conn:
+        conn.execute(FTS_TABLE)
+        for trigger in FTS_TRIGGERS:
+            conn.execute(trigger)
+        conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+    return True
+
+
+def fts_phrase(text: str) -> str:
+    """Quote text as an FTS5 phrase, matching its words in order"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Create or migrate posts databases")
+    parser.add_argument("db_names", nargs="+", metavar="posts.sqlite3")
+    parser.add_argument("--fts", action="store_true", help="Build the full text index too")
+    args = parser.parse_args()
+    for db_name in args.db_names:
+        conn = sqlite3.connect(db_name)
+        try:
+            was = ensure_schema(conn)
+            built = ensure_fts(conn) if args.fts else False
+        except sqlite3.Error as e:
+            parser.exit(1, f"{db_name}: {e}\n")
+        finally:
+            conn.close()
+        print(f"{db_name}: schema version {was} -> {SCHEMA_VERSION}" + (", full text index built" if built else ""))
+
+
+if __name__ == "__main__":
+    main()
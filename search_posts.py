@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Search the posts saved by dumplse.py, with the full text index built by
+`posts_schema.py --fts` or `dumplse.py --save --fts`
+
+The query is FTS5 syntax: words, "quoted phrases", AND/OR/NOT, prefix*, and
+title:/text: to search just one of them.
+
+eg.
+    $ ./search_posts.py 'hydrogen AND (blue OR green)' -t RDSB
+    $ ./search_posts.py --phrase 'big news just' --since 2024-03-01 -n 5
+"""
+import argparse
+import sqlite3
+import sys
+from datetime import datetime
+
+from colorama import Fore
+
+from posts_schema import day, day_epochs, from_epoch, fts_phrase, has_fts
+
+HIGHLIGHT = ("\033[7m", "\033[0m")
+
+
+def get_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Search saved LSE chat posts")
+    parser.add_argument("query", help="FTS5 query, or the exact words to find with --phrase")
+    parser.add_argument("--phrase", "-P", help="Find the query's words together, in order", action="store_true")
+    parser.add_argument("--ticker", "-t", help="Only posts on this ticker", type=str)
+    parser.add_argument("--user", "-u", help="Only posts by this user", type=str)
+    parser.add_argument("--since", help="Only posts on or after YYYY-MM-DD", type=day)
+    parser.add_argument("--until", help="Only posts on or before YYYY-MM-DD", type=day)
+    parser.add_argument("--rank", "-r", help="Best matches first, rather than newest", action="store_true")
+    parser.add_argument("--number", "-n", help="Number of posts to show", type=int, default=20)
+    parser.add_argument("--db", help="Posts database", default="posts.sqlite3")
+    return parser.parse_args()
+
+
+def search_posts(
+    conn: sqlite3.Connection,
+    query: str,
+    ticker: str | None = None,
+    user: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    rank: bool = False,
+    limit: int = 20,
+) -> list[tuple]:
+    """
+    Returns (username, ticker, atprice, opinion, date, title, text) for the
+    posts matching an FTS5 query, with the matches in the title and text
+    highlighted, newest first (or best match first if rank)
+    """
+    sql = f"""
+        SELECT p.username, p.ticker, p.atprice, p.opinion, p.epoch,
+            highlight(posts_fts, 0, ?, ?), highlight(posts_fts, 1, ?, ?)
+        FROM posts_fts f
+        JOIN posts p ON p.rowid = f.rowid
+        WHERE posts_fts MATCH ?
+        {"AND p.ticker = ?" if ticker else ""}
+        {"AND p.username = ?" if user else ""}
+        {"AND p.epoch >= ?" if since else ""}
+        {"AND p.epoch < ?" if until else ""}
+        ORDER BY {"f.rank" if rank else "p.epoch DESC"}
+        LIMIT ?
+    """
+    params: list = [*HIGHLIGHT, *HIGHLIGHT, query]
+    if ticker:
+        params.append(ticker.upper())
+    if user:
+        params.append(user)
+    start, end = day_epochs(since, until)
+    if start is not None:
+        params.append(start)
+    if end is not None:
+        params.append(end)
+    params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def main() -> None:
+    arg = get_arguments()
+    conn = sqlite3.connect(arg.db)
+    if not has_fts(conn):
+        print(
+            f"{Fore.RED}[!] Error: {arg.db} has no full text index, "
+            f"build it with ./posts_schema.py --fts {arg.db}{Fore.RESET}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    query = fts_phrase(arg.query) if arg.phrase else arg.query
+    try:
+        posts = search_posts(conn, query, arg.ticker, arg.user, arg.since, arg.until, arg.rank, arg.number)
+    except sqlite3.OperationalError as e:
+        print(f"{Fore.RED}[!] Error: bad query '{query}': {e}{Fore.RESET}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    for username, ticker, atprice, opinion, epoch, title, text in posts:
+        when = from_epoch(epoch) if epoch is not None else ""
+        print(
+            f"{(Fore.GREEN + username):21}"
+            f"{Fore.BLUE} [{ticker}] @{atprice}{Fore.RESET} "
+            f"{('(' + str(when) + ')'):20} "
+            f"{opinion} "
+            f"{Fore.CYAN}{title}{Fore.RESET}\n"
+            f"{text}\n"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
 #!/usr/bin/env python3
 """A rudimentary sentiment analysis tool for examining the default sqlite db
 produced by dumplse.py"""
+import heapq
+import json
+import os
 import re
 import sqlite3
-from datetime import datetime, timedelta
-from collections import defaultdict
+from datetime import date, datetime
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from pathlib import Path
+
+import numpy as np
+
+from posts_schema import ensure_schema, fts_phrase, has_fts, to_epoch
 
 # Sentiment keyword sets
 POSITIVE = {
@@ -65,133 +75,482 @@ NEGATIVE = {
         }
 
 
-def highlight_words(text, word_list, highlight_format="**{}**"):
-    """Highlight words in text that match those in word_list"""
-    pattern = r'\b(' + '|'.join(re.escape(word) for word in word_list) + r')\b'
-    return re.sub(pattern, lambda m: highlight_format.format(m.group(1)), text, flags=re.IGNORECASE)
+def trie_pattern(terms):
+    """A regex alternation of terms, factored into a trie on their characters,
+    so matching tries one branch per character rather than every term"""
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term.lower():
+            node = node.setdefault(char, {})
+        node[''] = {}
 
+    def pattern(node):
+        # Longer terms first, as the greedy optional group tries them first
+        branches = [re.escape(char) + pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        alternation = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return '(?:' + alternation + ')?' if '' in node else alternation
 
-def analyze_sentiment_predictions(db_path='posts.sqlite3', start_date='2024-01', end_date=None, ticker=None, username=None, threshold_pct=0.2, day_range='3-14'):
-    """Analyze sentiment prediction accuracy for an n-day timeframe"""
+    return pattern(trie)
 
-    # Parse day range
-    start_day, end_day = map(int, day_range.split('-'))
 
-    # Default to current date if end_date not provided
-    if end_date is None:
-        today = datetime.now()
-        end_date = f'{today.year}-{today.month:02d}'
+def compile_terms(terms):
+    """Compile a keyword set into one regex, matching a term only where it's
+    bounded by spaces or the ends of the text (as our old SQL LIKEs did)"""
+    # ASCII, so only A-Z are case folded, same as SQLite's LOWER() and LIKE
+    # \A and \Z, as $ would also match before a trailing newline
+    return re.compile(r'(?:\A| )(' + trie_pattern(terms) + r')(?= |\Z)', re.IGNORECASE | re.ASCII)
 
-    # Parse start and end dates
-    start_year, start_month = map(int, start_date.split('-'))
-    end_year, end_month = map(int, end_date.split('-'))
 
-    conn = sqlite3.connect(db_path)
+POSITIVE_RE = compile_terms(POSITIVE)
+NEGATIVE_RE = compile_terms(NEGATIVE)
+
+
+def classify_sentiment(text):
+    """Returns 'BULLISH', 'BEARISH' or None for a post's text, along with the
+    (start, end) spans of the terms which decided it"""
+    if not text:
+        return None, []
+    positive = [m.span(1) for m in POSITIVE_RE.finditer(text)]
+    negative = [m.span(1) for m in NEGATIVE_RE.finditer(text)]
+    if positive and not negative:
+        return 'BULLISH', positive
+    if negative and not positive:
+        return 'BEARISH', negative
+    return None, []
+
+
+def count_terms(text):
+    """Returns how many POSITIVE and NEGATIVE terms appear in a post's text"""
+    if not text:
+        return 0, 0
+    return sum(1 for _ in POSITIVE_RE.finditer(text)), sum(1 for _ in NEGATIVE_RE.finditer(text))
+
+
+def sentiment_of(positive, negative):
+    """The sentiment for a post with these keyword counts, see classify_sentiment"""
+    if positive and not negative:
+        return 'BULLISH'
+    if negative and not positive:
+        return 'BEARISH'
+    return None
+
+
+# Bumped whenever compile_terms matches differently, so posts get reclassified
+MATCHER_VERSION = 2
+
+
+def keywords_version():
+    """A short fingerprint of the current POSITIVE and NEGATIVE sets, and of
+    how they're matched"""
+    keywords = '\n'.join(sorted(POSITIVE)) + '\0' + '\n'.join(sorted(NEGATIVE)) + '\0' + str(MATCHER_VERSION)
+    return sha256(keywords.encode('utf8')).hexdigest()[:16]
+
+
+def classify_rows(rows):
+    """Classify (hash, text) rows as (sentiment, positive, negative, hash)"""
+    classified = []
+    for post_hash, text in rows:
+        positive, negative = count_terms(text)
+        classified.append((sentiment_of(positive, negative), positive, negative, post_hash))
+    return classified
+
+
+def classified_chunks(chunks, pool=None, jobs=1):
+    """
+    Yield classify_rows of each chunk in order, with up to twice jobs chunks
+    out in the pool at once if there is one
+    """
+    if pool is None:
+        yield from map(classify_rows, chunks)
+        return
+    window = deque()
+    for chunk in chunks:
+        window.append(pool.submit(classify_rows, chunk))
+        if len(window) >= jobs * 2:
+            yield window.popleft().result()
+    while window:
+        yield window.popleft().result()
+
+
+def update_sentiment(conn, jobs=1):
+    """
+    Bring the sentiment table, a per post cache of classify_sentiment, up to
+    date with the posts table and the current keyword sets. Only posts which
+    haven't been classified yet, or which contain a keyword added or removed
+    since they were, get classified, over jobs processes if more than one.
+    Those are found with the full text index, when the database has one.
+    """
+    CHUNK = 10000
+    version = keywords_version()
     cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sentiment
+        (hash TEXT PRIMARY KEY,
+        sentiment TEXT,
+        positive INTEGER,
+        negative INTEGER,
+        version TEXT)
+    """)
+    # The keyword sets behind each version, so we can tell what changed
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sentiment_keywords
+        (version TEXT PRIMARY KEY,
+        positive TEXT,
+        negative TEXT)
+    """)
+    cursor.execute(
+        "INSERT OR IGNORE INTO sentiment_keywords (version, positive, negative) VALUES (?, ?, ?)",
+        (version, json.dumps(sorted(POSITIVE)), json.dumps(sorted(NEGATIVE))),
+    )
+
+    pool = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    use_fts = has_fts(conn)
+
+    old_versions = [row[0] for row in cursor.execute(
+        "SELECT DISTINCT version FROM sentiment WHERE version != ?", (version,))]
+    for old_version in old_versions:
+        row = cursor.execute(
+            "SELECT positive, negative FROM sentiment_keywords WHERE version = ?", (old_version,)).fetchone()
+        changed = None
+        if row:
+            changed = (set(json.loads(row[0])) ^ POSITIVE) | (set(json.loads(row[1])) ^ NEGATIVE)
+            if not changed:
+                # Same keywords, so it's the matching that changed, and any
+                # post might have
+                row = None
+        changed_re = compile_terms(changed) if changed else None
+
+        # Posts without any changed keyword in them can't have changed sentiment,
+        # and the full text index, if there is one, can find those that might
+        # have without reading every post. It matches a little more loosely
+        # than the keyword regexes, which still make the final call below.
+        if row is not None and use_fts and changed and all(any(c.isalnum() for c in term) for term in changed):
+            rows = conn.execute(
+                "SELECT s.hash, p.text FROM posts_fts f JOIN posts p ON p.rowid = f.rowid"
+                " JOIN sentiment s ON s.hash = p.hash WHERE posts_fts MATCH ? AND s.version = ?",
+                ('text : (' + ' OR '.join(map(fts_phrase, sorted(changed))) + ')', old_version))
+        else:
+            rows = conn.execute(
+                "SELECT s.hash, p.text FROM sentiment s JOIN posts p ON p.hash = s.hash WHERE s.version = ?",
+                (old_version,))
+        chunks = iter(lambda: rows.fetchmany(CHUNK), [])
+        if row is not None:
+            chunks = ([(h, text) for h, text in chunk if changed_re and text and changed_re.search(text)]
+                      for chunk in chunks)
+        for classified in classified_chunks(chunks, pool, jobs):
+            cursor.executemany(
+                "UPDATE sentiment SET sentiment = ?, positive = ?, negative = ? WHERE hash = ?",
+                classified)
+        # Leave the version alone until we're done scanning for it
+        cursor.execute("UPDATE sentiment SET version = ? WHERE version = ?", (version, old_version))
+
+    rows = conn.execute(
+        "SELECT hash, text FROM posts WHERE hash NOT IN (SELECT hash FROM sentiment)")
+    for classified in classified_chunks(iter(lambda: rows.fetchmany(CHUNK), []), pool, jobs):
+        cursor.executemany(
+            "INSERT INTO sentiment (sentiment, positive, negative, hash, version) VALUES (?, ?, ?, ?, ?)",
+            (row + (version,) for row in classified))
+    if pool:
+        pool.shutdown()
+    conn.commit()
+    cursor.close()
+
+
+def highlight_spans(text, spans, highlight_format="**{}**"):
+    """Highlight the (start, end) spans of text, as found by classify_sentiment"""
+    parts = []
+    last = 0
+    for start, end in spans:
+        parts.append(text[last:start])
+        parts.append(highlight_format.format(text[start:end]))
+        last = end
+    parts.append(text[last:])
+    return ''.join(parts)
+
+
+# Price series are keyed by ticker and day, as ticker * KEY_STRIDE + day
+DAY = 86400
+KEY_STRIDE = 1 << 32
+KEY_OFFSET = 1 << 31
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def tickers_clause(tickers, column='ticker'):
+    """SQL and params matching any of a list of tickers, including None"""
+    names = [name for name in tickers if name is not None]
+    clause = f"{column} IN ({', '.join('?' * len(names))})"
+    if None in tickers:
+        clause = f"({clause} OR {column} IS NULL)"
+    return clause, names
+
+
+def daily_prices(cursor, ticker=None, tickers=None):
+    """
+    Build every ticker's daily price series, the last price seen each day.
+    Returns a dict of ticker ids, and arrays of (ticker, day) keys and prices
+    sorted by key, so a ticker's n-day window is one searchsorted away
+    """
+    CHUNK = 100000
+    query = "SELECT ticker, epoch, pence FROM posts WHERE pence IS NOT NULL AND epoch IS NOT NULL"
+    params = []
+    if ticker:
+        query += " AND ticker = ?"
+        params.append(ticker)
+    if tickers is not None:
+        clause, names = tickers_clause(tickers)
+        query += " AND " + clause
+        params += names
+    cursor.execute(query + " ORDER BY epoch, rowid", params)
+    ticker_ids = {}
+
+    def last_of_day(keys, prices):
+        # A stable sort keeps each day's prices in the order they were posted,
+        # so the last of each run of equal keys is the day's last price
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        prices = prices[order]
+        last = np.append(keys[1:] != keys[:-1], True)
+        return keys[last], prices[last]
+
+    # Reduce each chunk to its days as we go, so we only ever hold a chunk of
+    # posts and one price per ticker per day
+    days = []
+    while rows := cursor.fetchmany(CHUNK):
+        names, epochs, pences = zip(*rows)
+        ids = np.array([ticker_ids.setdefault(name, len(ticker_ids)) for name in names], np.int64)
+        keys = ids * KEY_STRIDE + KEY_OFFSET + np.array(epochs, np.int64) // DAY
+        days.append(last_of_day(keys, np.array(pences, np.float64)))
+    if not days:
+        return ticker_ids, np.empty(0, np.int64), np.empty(0)
+    keys, prices = last_of_day(np.concatenate([k for k, _ in days]), np.concatenate([p for _, p in days]))
+    return ticker_ids, keys, prices
+
+
+def prediction_arrays(predictions, series):
+    """
+    The per prediction arrays every scoring needs, whatever the threshold or
+    day range: price, day, where its ticker's series is keyed and if BULLISH
+    """
+    ticker_ids = series[0]
+    pred_price = np.array([float(p[1]) for p in predictions])
+    pred_day = np.array([p[2] for p in predictions], np.int64) // DAY
+    base = np.array([ticker_ids.get(p[5], -1) for p in predictions], np.int64) * KEY_STRIDE + KEY_OFFSET
+    bullish = np.array([p[3] == 'BULLISH' for p in predictions], bool)
+    return pred_price, pred_day, base, bullish
+
+
+def forward_window(series, arrays, start_day, end_day):
+    """
+    Gather each prediction's prices from start_day to end_day days later.
+    Returns how many days had a price, their total, and (predictions x days)
+    arrays of the prices, their keys and which are inside the window
+    """
+    _, keys, prices = series
+    _, pred_day, base, _ = arrays
+    width = end_day - start_day + 1
+
+    # Where each prediction's window of days starts in the series, and how
+    # many of those days we have a price for
+    first = np.searchsorted(keys, base + pred_day + start_day, 'left')
+    count = np.searchsorted(keys, base + pred_day + end_day, 'right') - first
+    inside = np.arange(width) < count[:, None]
+    index = np.where(inside, first[:, None] + np.arange(width), 0)
+    window_prices = np.where(inside, prices[index], 0.0)
+    window_keys = keys[index]
+
+    # Add up a day at a time, in the same order as sum() would
+    total = np.zeros(len(count))
+    for k in range(width):
+        total += window_prices[:, k]
+    return count, total, window_prices, window_keys, inside
+
+
+def score_window(arrays, window, threshold_pct):
+    """
+    Score every prediction's window against a threshold. Returns which could
+    be scored, their average future price, percent move, whether they were
+    correct, and the key of the first day past the threshold (or -1)
+    """
+    pred_price, _, _, bullish = arrays
+    count, total, window_prices, window_keys, inside = window
+    upper = pred_price * (1 + threshold_pct)
+    lower = pred_price * (1 - threshold_pct)
+
+    crossed = inside & np.where(bullish[:, None], window_prices > upper[:, None], window_prices < lower[:, None])
+    first_crossed = crossed.argmax(axis=1)
+    threshold_key = np.where(crossed.any(axis=1), window_keys[np.arange(len(count)), first_crossed], -1)
+
+    scored = count >= 3  # Want at least 3 predictions to make a good average
+    avg_future_price = np.divide(total, count, out=np.zeros(len(count)), where=scored)
+    price_change_pct = (avg_future_price - pred_price) / pred_price * 100
+    correct = np.where(bullish, avg_future_price > upper, avg_future_price < lower)
+    return scored, avg_future_price, price_change_pct, correct, threshold_key
+
+
+def score_predictions(predictions, series, start_day, end_day, threshold_pct):
+    """
+    Score every prediction against its ticker's prices start_day to end_day
+    days later, all at once. Returns the results list of dicts, one for each
+    prediction with at least 3 days of prices to average.
+    """
+    return [result for _, result in scored_predictions(predictions, series, start_day, end_day, threshold_pct)]
+
+
+def scored_predictions(predictions, series, start_day, end_day, threshold_pct):
+    """score_predictions, as (index into predictions, result) pairs"""
+    if not predictions or len(series[1]) == 0:
+        return []
+
+    arrays = prediction_arrays(predictions, series)
+    window = forward_window(series, arrays, start_day, end_day)
+    scored, avg_future_price, price_change_pct, correct, threshold_key = score_window(arrays, window, threshold_pct)
+    pred_price, pred_day, base, _ = arrays
+    threshold_day = threshold_key - base
+
+    results = []
+    for i in np.flatnonzero(scored).tolist():
+        username, _, _, sentiment, text_sample, ticker, spans = predictions[i]
+        results.append((i, {
+            'username': username,
+            'pred_price': pred_price[i].item(),
+            'pred_date': date.fromordinal(EPOCH_ORDINAL + pred_day[i].item()),
+            'sentiment': sentiment,
+            'avg_future_price': avg_future_price[i].item(),
+            'price_change_pct': price_change_pct[i].item(),
+            'correct': correct[i].item(),
+            'ticker': ticker,
+            'text_sample': text_sample,
+            'spans': spans,
+            'threshold_date': date.fromordinal(EPOCH_ORDINAL + threshold_day[i].item()) if threshold_key[i] >= 0 else None
+        }))
+    return results
+
+
+def open_posts(db_path='posts.sqlite3', jobs=1):
+    """Open the posts database, with its schema and sentiment table up to date"""
+    conn = sqlite3.connect(db_path)
+    # Older databases get their typed date and price columns filled in here
+    ensure_schema(conn)
 
     #if POSITIVE & NEGATIVE == set():
     #    print(f"Error in sets, duplicate sentiments: {POSITIVE & NEGATIVE}\n")
     #    sys.exit(1)
 
-    # Build dynamic SQL query using sentiment sets with word boundaries
-    def make_word_boundary_condition(term):
-        escaped = term.replace("'", "''")  # Escape single quotes for SQL
-        return f"(LOWER(text) LIKE '% {escaped.lower()} %' OR LOWER(text) LIKE '{escaped.lower()} %' OR LOWER(text) LIKE '% {escaped.lower()}' OR LOWER(text) = '{escaped.lower()}')"
-    
-    positive_conditions = " OR ".join([make_word_boundary_condition(term) for term in POSITIVE])
-    negative_conditions = " OR ".join([make_word_boundary_condition(term) for term in NEGATIVE])
+    # Posts are classified once and kept in the sentiment table, so we only
+    # need to classify what's new, or affected by changes to the keywords
+    update_sentiment(conn, jobs)
+    return conn
+
 
+def open_read_only(db_path='posts.sqlite3'):
+    """Open the posts database read only, for the worker processes"""
+    return sqlite3.connect(Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+
+
+def prediction_rows(conn, start_date='2024-01', end_date=None, ticker=None, username=None, tickers=None, with_rowid=False):
+    """
+    Returns a cursor over the posts in the date range with a sentiment, as
+    (username, price, epoch, sentiment, text, ticker) rows in posted order,
+    each led by its rowid if with_rowid
+    """
+    # Default to current date if end_date not provided
+    if end_date is None:
+        today = datetime.now()
+        end_date = f'{today.year}-{today.month:02d}'
+
+    # Parse start and end dates
+    start_year, start_month = map(int, start_date.split('-'))
+    end_year, end_month = map(int, end_date.split('-'))
+
+    clause, names = tickers_clause(tickers, 'p.ticker') if tickers is not None else ('', [])
     predictions_query = f"""
-    SELECT 
-        username,
-        atprice as pred_price,
-        date as pred_date,
-        CASE 
-            WHEN ({positive_conditions}) AND NOT ({negative_conditions}) THEN 'BULLISH'
-            WHEN ({negative_conditions}) AND NOT ({positive_conditions}) THEN 'BEARISH'
-            ELSE NULL
-        END as sentiment,
-        text as text_sample,
-        ticker as ticker
-    FROM posts 
-    WHERE date >= ? AND date <= ?
-    AND (({positive_conditions}) OR ({negative_conditions}))
-    {' AND ticker = ?' if ticker else ''}
-    {' AND username = ?' if username else ''}
+    SELECT {'p.rowid,' if with_rowid else ''}
+        p.username,
+        p.pence as pred_price,
+        p.epoch as pred_epoch,
+        s.sentiment,
+        p.text as text_sample,
+        p.ticker as ticker
+    FROM posts p
+    JOIN sentiment s ON s.hash = p.hash
+    WHERE s.sentiment IS NOT NULL
+    AND p.epoch >= ? AND p.epoch < ?
+    AND p.pence IS NOT NULL
+    {' AND p.ticker = ?' if ticker else ''}
+    {' AND p.username = ?' if username else ''}
+    {' AND ' + clause if clause else ''}
+    ORDER BY p.rowid
     """
 
-    params = [f'{start_year}-{start_month:02d}-01', f'{end_year}-{end_month:02d}-31']
+    # From the start of start_date's month, up to the end of end_date's month
+    end_year, end_month = (end_year + 1, 1) if end_month == 12 else (end_year, end_month + 1)
+    params = [to_epoch(f'{start_year}-{start_month:02d}-01 00:00:00'), to_epoch(f'{end_year}-{end_month:02d}-01 00:00:00')]
     if ticker:
         params.append(ticker)
     if username:
         params.append(username)
+    return conn.execute(predictions_query, params + names)
+
 
-    cursor.execute(predictions_query, params)
-    predictions = cursor.fetchall()
+def load_predictions(db_path='posts.sqlite3', start_date='2024-01', end_date=None, ticker=None, username=None, with_spans=True, jobs=1):
+    """
+    Returns the posts in the date range with a sentiment, as prediction
+    tuples, and the daily price series to score them against
+    """
+    conn = open_posts(db_path, jobs)
 
-    # Get all price data
-    cursor.execute("SELECT date, atprice, ticker FROM posts WHERE atprice IS NOT NULL ORDER BY date")
-    price_data = cursor.fetchall()
+    predictions = []
+    for row in prediction_rows(conn, start_date, end_date, ticker, username):
+        # Only the predictions need their keyword spans, for highlighting
+        spans = classify_sentiment(row[4])[1] if with_spans else []
+        predictions.append(row + (spans,))
+
+    # Each ticker's daily price series, built once for all the predictions
+    series = daily_prices(conn.cursor(), ticker)
 
     conn.close()
+    return predictions, series
 
-    # Convert to dict for faster lookup - key by (date, ticker)
-    prices = {}
-    for date_str, price, ticker_name in price_data:
-        date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-        prices[(date_obj.date(), ticker_name)] = price
 
-    results = []
+def ticker_partitions(conn, jobs, ticker=None):
+    """
+    Split the tickers into up to jobs lists with about as many posts each,
+    the same way every time
+    """
+    if ticker:
+        return [[ticker]]
+    counts = conn.execute("SELECT ticker, COUNT(*) FROM posts WHERE pence IS NOT NULL GROUP BY ticker").fetchall()
+    counts.sort(key=lambda x: (-x[1], x[0] is None, x[0] or ''))
+    partitions = [[0, n, []] for n in range(min(jobs, len(counts)))]
+    for name, count in counts:
+        # Biggest tickers first, each into whichever list has the fewest posts
+        smallest = min(partitions)
+        smallest[0] += count
+        smallest[2].append(name)
+    return [tickers for _, _, tickers in partitions]
+
+
+def score_tickers(db_path, tickers, start_date, end_date, username, threshold_pct, start_day, end_day):
+    """
+    Score the predictions on a list of tickers, in a worker process with its
+    own read only connection. Returns (rowid, result) pairs in rowid order.
+    """
+    conn = open_read_only(db_path)
+    rowids, predictions = [], []
+    for rowid, *row in prediction_rows(conn, start_date, end_date, username=username, tickers=tickers, with_rowid=True):
+        rowids.append(rowid)
+        predictions.append(tuple(row) + (classify_sentiment(row[4])[1],))
+    series = daily_prices(conn.cursor(), tickers=tickers)
+    conn.close()
+
+    return [(rowids[i], result) for i, result in scored_predictions(predictions, series, start_day, end_day, threshold_pct)]
 
-    for username, pred_price, pred_date_str, sentiment, text_sample, ticker in predictions:
-        if not sentiment:
-            continue
-
-        pred_date = datetime.strptime(pred_date_str, '%Y-%m-%d %H:%M:%S').date()
-
-        # Find future prices of the ticker within n days after prediction
-        future_prices = []
-        threshold_date = None
-        for i in range(start_day, end_day + 1):
-            future_date = pred_date + timedelta(days=i)
-            if (future_date, ticker) in prices:
-                price = float(prices[(future_date, ticker)])
-                future_prices.append(price)
-                # Check if threshold met on this date
-                if not threshold_date:
-                    if sentiment == 'BULLISH' and price > float(pred_price) * (1 + threshold_pct):
-                        threshold_date = future_date
-                    elif sentiment == 'BEARISH' and price < float(pred_price) * (1 - threshold_pct):
-                        threshold_date = future_date
-
-        if len(future_prices) >= 3:  # Want at least 3 predictions to make a good average
-            # Convert to float and filter out None values
-            valid_prices = [float(p) for p in future_prices if p is not None]
-            if len(valid_prices) >= 3:
-                avg_future_price = sum(valid_prices) / len(valid_prices)
-            price_change_pct = (avg_future_price - float(pred_price)) / float(pred_price) * 100
-
-            # Determine if prediction was correct (% threshold)
-            correct = False
-            if sentiment == 'BULLISH' and avg_future_price > float(pred_price) * (1 + threshold_pct):
-                correct = True
-            elif sentiment == 'BEARISH' and avg_future_price < float(pred_price) * (1 - threshold_pct):
-                correct = True
-
-            results.append({
-                'username': username,
-                'pred_price': float(pred_price),
-                'pred_date': pred_date,
-                'sentiment': sentiment,
-                'avg_future_price': avg_future_price,
-                'price_change_pct': price_change_pct,
-                'correct': correct,
-                'ticker': ticker,
-                'text_sample': text_sample,
-                'threshold_date': threshold_date
-            })
-
-    # Calculate accuracy by user
+
+def accuracy_by_user(results):
+    """Each user's accuracy stats over results, best first"""
     user_stats = defaultdict(lambda: {'total': 0, 'correct': 0, 'price_moves': []})
 
     for result in results:
@@ -215,11 +574,169 @@ def analyze_sentiment_predictions(db_path='posts.sqlite3', start_date='2024-01',
             }
 
     # Sort by accuracy, then by total predictions
-    sorted_users = sorted(accuracy_stats.items(), 
-                         key=lambda x: (x[1]['accuracy_pct'], x[1]['total_predictions']), 
+    return sorted(accuracy_stats.items(),
+                  key=lambda x: (x[1]['accuracy_pct'], x[1]['total_predictions']),
+                  reverse=True)
+
+
+def analyze_sentiment_predictions(db_path='posts.sqlite3', start_date='2024-01', end_date=None, ticker=None, username=None, threshold_pct=0.2, day_range='3-14', jobs=1):
+    """
+    Analyze sentiment prediction accuracy for an n-day timeframe, split by
+    ticker over jobs processes if more than one
+    """
+
+    # Parse day range
+    start_day, end_day = map(int, day_range.split('-'))
+
+    if jobs > 1:
+        # Every worker must agree on what "current month" is
+        if end_date is None:
+            end_date = f'{datetime.now():%Y-%m}'
+        conn = open_posts(db_path, jobs)
+        partitions = ticker_partitions(conn, jobs, ticker)
+        conn.close()
+        with ProcessPoolExecutor(max_workers=len(partitions) or 1) as pool:
+            parts = pool.map(score_tickers, *zip(*[
+                (db_path, tickers, start_date, end_date, username, threshold_pct, start_day, end_day)
+                for tickers in partitions])) if partitions else []
+            # Back into rowid order, so the stats add up exactly as they would serially
+            results = [result for _, result in heapq.merge(*parts, key=lambda x: x[0])]
+    else:
+        predictions, series = load_predictions(db_path, start_date, end_date, ticker, username)
+        results = score_predictions(predictions, series, start_day, end_day, threshold_pct)
+
+    return accuracy_by_user(results), results
+
+
+def stream_sentiment_predictions(db_path='posts.sqlite3', start_date='2024-01', end_date=None, ticker=None, username=None, threshold_pct=0.2, day_range='3-14', top_n=3, jobs=1):
+    """
+    The same accuracy stats as analyze_sentiment_predictions, in flat memory
+    however big the database. Predictions are scored a chunk at a time into
+    running totals per user, and only each user's top_n predictions (by
+    price move, as get_top_predictions picks them) are kept, in a heap.
+    Returns the sorted accuracy stats, and a dict of each user's top_n.
+    """
+    CHUNK = 10000
+    start_day, end_day = map(int, day_range.split('-'))
+
+    conn = open_posts(db_path, jobs)
+    series = daily_prices(conn.cursor(), ticker)
+    rows = prediction_rows(conn, start_date, end_date, ticker, username)
+
+    user_stats = {}
+    heaps = defaultdict(list)
+    seen = 0
+    while chunk := rows.fetchmany(CHUNK):
+        for result in score_predictions([row + ([],) for row in chunk], series, start_day, end_day, threshold_pct):
+            username = result['username']
+            stats = user_stats.setdefault(username, {'total': 0, 'correct': 0, 'price_move': 0})
+            stats['total'] += 1
+            if result['correct']:
+                stats['correct'] += 1
+            move = abs(result['price_change_pct'])
+            stats['price_move'] += move
+
+            # Biggest moves first, and the earliest of equal moves, like the
+            # stable sort in get_top_predictions
+            entry = (move, -seen, result)
+            seen += 1
+            if len(heaps[username]) < top_n:
+                heapq.heappush(heaps[username], entry)
+            elif heaps[username] and entry[:2] > heaps[username][0][:2]:
+                heapq.heapreplace(heaps[username], entry)
+    conn.close()
+
+    accuracy_stats = {}
+    for username, stats in user_stats.items():
+        if stats['total'] >= 3:
+            accuracy_stats[username] = {
+                'total_predictions': stats['total'],
+                'correct_calls': stats['correct'],
+                'accuracy_pct': (stats['correct'] / stats['total']) * 100,
+                'avg_price_move': stats['price_move'] / stats['total']
+            }
+    sorted_users = sorted(accuracy_stats.items(),
+                         key=lambda x: (x[1]['accuracy_pct'], x[1]['total_predictions']),
                          reverse=True)
 
-    return sorted_users, results
+    examples = {}
+    for username, heap in heaps.items():
+        examples[username] = [result for *_, result in sorted(heap, key=lambda e: e[:2], reverse=True)]
+        # Only the examples we keep need their keywords found again
+        for result in examples[username]:
+            result['spans'] = classify_sentiment(result['text_sample'])[1]
+    return sorted_users, examples
+
+
+def sweep_day_range(series, arrays, user_ids, users, day_range, thresholds):
+    """Per user (predictions, correct) counts for each threshold over one day range"""
+    start_day, end_day = map(int, day_range.split('-'))
+    window = forward_window(series, arrays, start_day, end_day)
+    cells = {}
+    for threshold_pct in thresholds:
+        scored, _, _, correct, _ = score_window(arrays, window, threshold_pct)
+        total = np.bincount(user_ids[scored], minlength=users)
+        right = np.bincount(user_ids[scored & correct], minlength=users)
+        cells[(threshold_pct, day_range)] = (total, right)
+    return cells
+
+
+def sweep_sentiment_predictions(db_path='posts.sqlite3', start_date='2024-01', end_date=None, ticker=None, username=None, thresholds=(0.2,), day_ranges=('3-14',), jobs=None):
+    """
+    Backtest every combination of thresholds and day ranges, loading and
+    classifying the posts only once. Returns the usernames, and a dict of
+    per user (predictions, correct) count arrays keyed by (threshold, range)
+    """
+    jobs = jobs or os.cpu_count() or 1
+    predictions, series = load_predictions(db_path, start_date, end_date, ticker, username, with_spans=False, jobs=jobs)
+    user_names = sorted({p[0] for p in predictions}, key=str)
+    if not predictions or len(series[1]) == 0:
+        return user_names, {}
+
+    index = {name: i for i, name in enumerate(user_names)}
+    user_ids = np.array([index[p[0]] for p in predictions], np.int64)
+    arrays = prediction_arrays(predictions, series)
+    args = [(series, arrays, user_ids, len(user_names), day_range, thresholds) for day_range in day_ranges]
+
+    cells = {}
+    jobs = min(jobs, len(day_ranges))
+    if jobs > 1:
+        # Each day range's windows are independent, so spread them over cores
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for result in pool.map(sweep_day_range, *zip(*args)):
+                cells.update(result)
+    else:
+        for arg in args:
+            cells.update(sweep_day_range(*arg))
+    return user_names, cells
+
+
+def print_sweep(user_names, cells, top=20):
+    """Print accuracy % (and number of predictions) per user for each cell"""
+    labels = {cell: f"{round(cell[0] * 100)}%/{cell[1]}" for cell in cells}
+    width = max([15] + [len(label) + 2 for label in labels.values()])
+
+    def row(name, counts):
+        line = f"{name:<20}"
+        for total, right in counts:
+            line += f"{f'{right / total * 100:.1f} ({total})' if total >= 3 else '-':>{width}}"
+        return line
+
+    print(f"{'Username':<20}" + "".join(f"{label:>{width}}" for label in labels.values()))
+    print("-" * (20 + width * len(labels)))
+    print(row('all users', [(total.sum(), right.sum()) for total, right in cells.values()]))
+
+    # Rank users by their mean accuracy over the cells they have 3+ predictions in
+    ranked = []
+    for i, name in enumerate(user_names):
+        counts = [(total[i], right[i]) for total, right in cells.values()]
+        accuracies = [right / total for total, right in counts if total >= 3]
+        if accuracies:
+            ranked.append((sum(accuracies) / len(accuracies), sum(t for t, _ in counts), name, counts))
+    ranked.sort(key=lambda x: (x[0], x[1]), reverse=True)
+    for _, _, name, counts in ranked[:top]:
+        print(row(str(name), counts))
+
 
 def get_top_predictions(results, username, n):
     """Get top predictions for a specific user"""
@@ -239,13 +756,29 @@ if __name__ == "__main__":
     parser.add_argument('--end-date', '-e', help='End date in YYYY-MM format (default: current month)')
     parser.add_argument('--future', '-f', default='3-14', help='Future price prediction day range (default: 3-14)')
     parser.add_argument('--number', '-n', default='3', help='Number of top predictions returned(default: 3)')
+    parser.add_argument('--jobs', '-j', type=int, help='Classify and score over this many processes (default: 1, or one per core for sweeps)')
+    parser.add_argument('--stream', action='store_true', help='Score in chunks, keeping only running totals, for databases too big for memory')
+    parser.add_argument('--sweep-percent', help='Backtest each of these comma separated thresholds, eg. 0.05,0.1,0.2')
+    parser.add_argument('--sweep-future', help='Backtest each of these comma separated day ranges, eg. 1-3,3-14')
     args = parser.parse_args()
     
     ticker_msg = f" for {args.ticker}" if args.ticker else ""
     username_msg = f" by {args.username}" if args.username else ""
+
+    if args.sweep_percent or args.sweep_future:
+        thresholds = [float(p) for p in args.sweep_percent.split(',')] if args.sweep_percent else [args.percent]
+        day_ranges = args.sweep_future.split(',') if args.sweep_future else [args.future]
+        print(f"Backtesting {len(thresholds) * len(day_ranges)} threshold/day range combinations ({args.start_date} to {args.end_date or 'current'}){ticker_msg}{username_msg}...")
+        user_names, cells = sweep_sentiment_predictions(ticker=args.ticker.upper() if args.ticker else None, username=args.username, start_date=args.start_date, end_date=args.end_date, thresholds=thresholds, day_ranges=day_ranges, jobs=args.jobs)
+        print("\nAccuracy % (predictions) by threshold/day range, top 20 predictors:")
+        print_sweep(user_names, cells)
+        raise SystemExit
     print(f"Analyzing price prediction accuracy (+/-{round(args.percent*100)}% within {args.future} days) ({args.start_date} to {args.end_date or 'current'}){ticker_msg}{username_msg}...")
 
-    accuracy_stats, results = analyze_sentiment_predictions(ticker=args.ticker.upper(), username=args.username, threshold_pct=args.percent, start_date=args.start_date, end_date=args.end_date, day_range=args.future)
+    if args.stream:
+        accuracy_stats, top_predictions = stream_sentiment_predictions(ticker=args.ticker.upper() if args.ticker else None, username=args.username, threshold_pct=args.percent, start_date=args.start_date, end_date=args.end_date, day_range=args.future, top_n=int(args.number), jobs=args.jobs or 1)
+    else:
+        accuracy_stats, results = analyze_sentiment_predictions(ticker=args.ticker.upper() if args.ticker else None, username=args.username, threshold_pct=args.percent, start_date=args.start_date, end_date=args.end_date, day_range=args.future, jobs=args.jobs or 1)
 
     print("\nTop 20 Most Accurate Predictors:")
     print("=" * 80)
@@ -270,7 +803,7 @@ if __name__ == "__main__":
         if user_found:
             print(f"\n\nTop predictions from {user}:")
             print("=" * 60)
-            examples = get_top_predictions(results, user, args.number)
+            examples = top_predictions[user] if args.stream else get_top_predictions(results, user, args.number)
             highlight_bull = "\033[32m\033[7m{}\033[0m" # Green
             highlight_bear = "\033[31m\033[7m{}\033[0m" # Red
             for pred in examples:
@@ -281,13 +814,13 @@ if __name__ == "__main__":
                     print(f"{status} {pred['ticker']} {pred['pred_date']} | "
                           f"{pred['sentiment']} @ {pred['pred_price']:.2f}p → "
                           f"{pred['avg_future_price']:.2f}p ({pred['price_change_pct']:+.1f}%){threshold_info}\33[0m")
-                    print(f"   {highlight_words(pred['text_sample'], POSITIVE, highlight_bull)}")
+                    print(f"   {highlight_spans(pred['text_sample'], pred['spans'], highlight_bull)}")
 
                 if 'BEARISH' in pred['sentiment']:
                     threshold_info = f" (hit {pred['threshold_date']})" if pred['threshold_date'] else ""
                     print(f"{status} {pred['ticker']} {pred['pred_date']} | "
                           f"{pred['sentiment']} @ {pred['pred_price']:.2f}p → "
                           f"{pred['avg_future_price']:.2f}p ({pred['price_change_pct']:+.1f}%){threshold_info}\33[0m")
-                    print(f"   {highlight_words(pred['text_sample'], NEGATIVE, highlight_bear)}")
+                    print(f"   {highlight_spans(pred['text_sample'], pred['spans'], highlight_bear)}")
 
                 print()